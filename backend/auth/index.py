@@ -8,44 +8,135 @@ Returns: HTTP response dict
 import json
 import os
 import hashlib
+import hmac
 import secrets
-import psycopg2
+import time
 from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from db import get_connection, release_connection
+from session import create_session, revoke_session, get_token, authenticate
+from response import json_response, error_response, options_response
+from tracing import traced
+from typing import Dict, Any, Optional
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+SCRYPT_N = int(os.environ.get('AUTH_SCRYPT_N', '16384'))
+SCRYPT_R = int(os.environ.get('AUTH_SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('AUTH_SCRYPT_P', '1'))
+DISCRIMINATOR_ATTEMPTS = 3
+PRESENCE_TTL_SECONDS = int(os.environ.get('PRESENCE_TTL_SECONDS', '90'))
+LAST_SEEN_INTERVAL_SECONDS = int(os.environ.get('LAST_SEEN_INTERVAL_SECONDS', '300'))
+PRESENCE_SWEEP_SECONDS = float(os.environ.get('PRESENCE_SWEEP_SECONDS', '60'))
+PRESENCE_SWEEP_BATCH = 1000
+PRESENCE_STATUSES = ('online', 'away')
 
-def generate_discriminator(conn, username: str) -> str:
-    cursor = conn.cursor()
-    for _ in range(9999):
-        disc = str(secrets.randbelow(9999)).zfill(4)
+_last_sweep = 0.0
+
+def hash_password(password: str, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P) -> str:
+    salt = secrets.token_bytes(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=32)
+    return f"scrypt${n}${r}${p}${salt.hex()}${digest.hex()}"
+
+def verify_password(password: str, password_hash: str) -> bool:
+    if not password_hash.startswith('scrypt$'):
+        # Старый формат: несолёный SHA-256
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, password_hash)
+    _, n, r, p, salt, expected = password_hash.split('$')
+    n, r, p = int(n), int(r), int(p)
+    digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=32)
+    return hmac.compare_digest(digest.hex(), expected)
+
+def needs_rehash(password_hash: str) -> bool:
+    return not password_hash.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+def create_user(conn, username: str, email: str, password_hash: str, avatar: str) -> Optional[Dict[str, Any]]:
+    # Случайный свободный тег выбирается и занимается одной командой; None — все теги заняты
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    for _ in range(DISCRIMINATOR_ATTEMPTS):
         cursor.execute(
-            "SELECT id FROM users WHERE username = %s AND discriminator = %s",
-            (username, disc)
+            """WITH candidate AS (
+                   SELECT lpad(n::text, 4, '0') AS discriminator
+                   FROM generate_series(1, 9999) n
+                   WHERE lpad(n::text, 4, '0') NOT IN (
+                       SELECT discriminator FROM users WHERE username = %s
+                   )
+                   ORDER BY random()
+                   LIMIT 1
+               ), inserted AS (
+                   INSERT INTO users (username, discriminator, email, password_hash, avatar, status)
+                   SELECT %s, discriminator, %s, %s, %s, 'online' FROM candidate
+                   ON CONFLICT (username, discriminator) DO NOTHING
+                   RETURNING id, username, discriminator, avatar
+               )
+               SELECT i.id, i.username, i.discriminator, i.avatar
+               FROM candidate c LEFT JOIN inserted i ON TRUE""",
+            (username, username, email, password_hash, avatar)
         )
-        if not cursor.fetchone():
-            return disc
-    return "0000"
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        if row['id'] is not None:
+            return dict(row)
+        # Тег заняли параллельной регистрацией — выбираем другой
+    return None
+
+def record_heartbeat(conn, user_id: int, status: str) -> None:
+    # Продлеваем присутствие; last_seen и status в users пишутся не чаще раза в LAST_SEEN_INTERVAL_SECONDS
+    cursor = conn.cursor()
+    cursor.execute(
+        """WITH beat AS (
+               INSERT INTO presence (user_id, status, last_heartbeat, expires_at, last_seen_flushed_at)
+               VALUES (%s, %s, now(), now() + make_interval(secs => %s), now())
+               ON CONFLICT (user_id) DO UPDATE SET
+                   status = EXCLUDED.status,
+                   last_heartbeat = EXCLUDED.last_heartbeat,
+                   expires_at = EXCLUDED.expires_at,
+                   last_seen_flushed_at = CASE
+                       WHEN presence.status <> EXCLUDED.status
+                         OR presence.last_seen_flushed_at < now() - make_interval(secs => %s)
+                       THEN now() ELSE presence.last_seen_flushed_at END
+               RETURNING last_seen_flushed_at = now() AS flush
+           )
+           UPDATE users SET last_seen = now(), status = %s
+           WHERE id = %s AND EXISTS (SELECT 1 FROM beat WHERE flush)""",
+        (user_id, status, PRESENCE_TTL_SECONDS, LAST_SEEN_INTERVAL_SECONDS, status, user_id)
+    )
 
+def sweep_presence(conn) -> int:
+    # Истёкшие присутствия пачкой переводятся в offline; параллельные вызовы не мешают друг другу
+    cursor = conn.cursor()
+    cursor.execute(
+        """WITH expired AS (
+               DELETE FROM presence
+               WHERE user_id IN (
+                   SELECT user_id FROM presence
+                   WHERE expires_at < now()
+                   LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+               )
+               RETURNING user_id, last_heartbeat
+           )
+           UPDATE users u SET status = 'offline', last_seen = e.last_heartbeat
+           FROM expired e
+           WHERE u.id = e.user_id""",
+        (PRESENCE_SWEEP_BATCH,)
+    )
+    return cursor.rowcount
+
+def maybe_sweep_presence(conn) -> None:
+    global _last_sweep
+    now = time.monotonic()
+    if now - _last_sweep >= PRESENCE_SWEEP_SECONDS:
+        _last_sweep = now
+        sweep_presence(conn)
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return options_response('GET, POST, OPTIONS')
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    conn.autocommit = True
+    conn = None
     
     try:
         if method == 'POST':
@@ -59,118 +150,110 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 avatar = body.get('avatar', '👤')
                 
                 if not username or not email or not password:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Заполните все поля'}),
-                        'isBase64Encoded': False
-                    }
+                    return error_response(400, 'Заполните все поля')
                 
+                conn = get_connection()
                 cursor = conn.cursor(cursor_factory=RealDictCursor)
                 cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
                 if cursor.fetchone():
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Email уже используется'}),
-                        'isBase64Encoded': False
-                    }
+                    return error_response(400, 'Email уже используется')
                 
-                discriminator = generate_discriminator(conn, username)
-                password_hash = hash_password(password)
+                user = create_user(conn, username, email, hash_password(password), avatar)
+                if not user:
+                    return error_response(409, 'Все теги для этого имени заняты, выберите другое имя')
                 
-                cursor.execute(
-                    """INSERT INTO users (username, discriminator, email, password_hash, avatar, status) 
-                       VALUES (%s, %s, %s, %s, %s, 'online') RETURNING id, username, discriminator, avatar""",
-                    (username, discriminator, email, password_hash, avatar)
-                )
-                user = cursor.fetchone()
+                record_heartbeat(conn, user['id'], 'online')
+                token = create_session(conn, user['id'])
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'user': dict(user),
-                        'token': hashlib.sha256(f"{user['id']}{email}".encode()).hexdigest()
-                    }),
-                    'isBase64Encoded': False
-                }
+                return json_response(200, {
+                    'success': True,
+                    'user': dict(user),
+                    'token': token
+                })
             
             elif action == 'login':
                 email = body.get('email', '').strip()
                 password = body.get('password', '')
                 
                 if not email or not password:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Заполните все поля'}),
-                        'isBase64Encoded': False
-                    }
-                
-                password_hash = hash_password(password)
+                    return error_response(400, 'Заполните все поля')
+                
+                conn = get_connection()
                 cursor = conn.cursor(cursor_factory=RealDictCursor)
                 cursor.execute(
-                    "SELECT id, username, discriminator, avatar, email FROM users WHERE email = %s AND password_hash = %s",
-                    (email, password_hash)
+                    "SELECT id, username, discriminator, avatar, email, password_hash FROM users WHERE email = %s",
+                    (email,)
                 )
                 user = cursor.fetchone()
                 
-                if not user:
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный email или пароль'}),
-                        'isBase64Encoded': False
-                    }
+                if not user or not verify_password(password, user['password_hash']):
+                    return error_response(401, 'Неверный email или пароль')
                 
-                cursor.execute(
-                    "UPDATE users SET status = 'online', last_seen = CURRENT_TIMESTAMP WHERE id = %s",
-                    (user['id'],)
-                )
+                # Хэш старого формата или с устаревшими параметрами KDF пересчитываем при входе
+                password_hash = user.pop('password_hash')
+                
+                if needs_rehash(password_hash):
+                    cursor.execute(
+                        "UPDATE users SET password_hash = %s WHERE id = %s",
+                        (hash_password(password), user['id'])
+                    )
+                
+                record_heartbeat(conn, user['id'], 'online')
+                token = create_session(conn, user['id'])
+                
+                return json_response(200, {
+                    'success': True,
+                    'user': dict(user),
+                    'token': token
+                })
+            
+            elif action == 'heartbeat':
+                status = body.get('status', 'online')
+                
+                if status not in PRESENCE_STATUSES:
+                    return error_response(400, 'Неверный статус')
+                
+                user_id = authenticate(event)
+                if user_id is None:
+                    return error_response(401, 'Требуется авторизация')
+                
+                conn = get_connection()
+                record_heartbeat(conn, user_id, status)
+                maybe_sweep_presence(conn)
+                
+                return json_response(200, {'success': True, 'ttl': PRESENCE_TTL_SECONDS})
+            
+            elif action == 'logout':
+                token = get_token(event)
+                
+                if not token:
+                    return error_response(401, 'Требуется авторизация')
+                
+                conn = get_connection()
+                revoke_session(conn, token)
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'user': dict(user),
-                        'token': hashlib.sha256(f"{user['id']}{email}".encode()).hexdigest()
-                    }),
-                    'isBase64Encoded': False
-                }
+                return json_response(200, {'success': True})
         
         elif method == 'GET':
             user_id = event.get('queryStringParameters', {}).get('user_id')
             if user_id:
+                conn = get_connection()
                 cursor = conn.cursor(cursor_factory=RealDictCursor)
                 cursor.execute(
-                    "SELECT id, username, discriminator, avatar, status, activity FROM users WHERE id = %s",
+                    """SELECT u.id, u.username, u.discriminator, u.avatar, COALESCE(p.status, 'offline') as status, u.activity
+                       FROM users u
+                       LEFT JOIN presence p ON p.user_id = u.id AND p.expires_at > now()
+                       WHERE u.id = %s""",
                     (user_id,)
                 )
                 user = cursor.fetchone()
                 if user:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'user': dict(user)}),
-                        'isBase64Encoded': False
-                    }
+                    return json_response(200, {'user': dict(user)})
             
-            return {
-                'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Пользователь не найден'}),
-                'isBase64Encoded': False
-            }
+            return error_response(404, 'Пользователь не найден')
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
+        return error_response(405, 'Метод не поддерживается')
     
     finally:
-        conn.close()
+        if conn is not None:
+            release_connection(conn)
@@ -0,0 +1,71 @@
+"""
+Business: Пул соединений с БД, который переживает тёплые вызовы функции
+Args: DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_HEALTHCHECK_SECONDS из окружения; при DB_TRACE соединения с учётом запросов
+Returns: get_connection / release_connection для обработчика
+"""
+
+import os
+import threading
+import time
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from tracing import connection_factory
+from typing import Dict, Optional
+
+POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', '5'))
+HEALTHCHECK_SECONDS = float(os.environ.get('DB_POOL_HEALTHCHECK_SECONDS', '30'))
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_pid: Optional[int] = None
+_last_used: Dict[int, float] = {}
+_lock = threading.Lock()
+
+def get_pool() -> ThreadedConnectionPool:
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _lock:
+            if _pool is None or _pool_pid != pid:
+                # После fork соединения родителя не трогаем — создаём свой пул
+                _pool = ThreadedConnectionPool(
+                    POOL_MIN, POOL_MAX, os.environ['DATABASE_URL'], connection_factory=connection_factory()
+                )
+                _pool_pid = pid
+                _last_used.clear()
+    return _pool
+
+def _is_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < HEALTHCHECK_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        return True
+    except psycopg2.Error:
+        return False
+
+def get_connection():
+    pool = get_pool()
+    # После перезапуска базы мертвы все простаивающие соединения — проверяем, пока не найдём живое.
+    # Новое соединение из пула в _last_used ещё нет, поэтому цикл конечен
+    while True:
+        conn = pool.getconn()
+        if _is_alive(conn):
+            break
+        _last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+    conn.autocommit = True
+    return conn
+
+def release_connection(conn) -> None:
+    pool = get_pool()
+    if conn.closed:
+        _last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+        return
+    _last_used[id(conn)] = time.monotonic()
+    pool.putconn(conn)
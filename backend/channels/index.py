@@ -0,0 +1,273 @@
+"""
+Business: Серверы и текстовые каналы - список, создание, вступление, сообщения и история
+Args: event - dict с httpMethod, body, queryStringParameters
+      context - объект с атрибутами request_id, function_name
+Returns: HTTP response dict
+"""
+
+import json
+from psycopg2.extras import RealDictCursor
+from db import get_connection, release_connection
+from session import authenticate
+from response import json_response, error_response, options_response
+from tracing import traced
+from typing import Dict, Any, List, Optional
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+DEFAULT_CHANNELS = (('общий', 'text'), ('Голосовой', 'voice'))
+
+def channel_server(conn, memberships: Dict[int, Optional[int]], user_id: int, channel_id: int) -> Optional[int]:
+    # Сервер канала, если пользователь в нём состоит; кэш живёт один вызов
+    if channel_id not in memberships:
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT c.server_id FROM channels c
+               JOIN server_members m ON m.server_id = c.server_id AND m.user_id = %s
+               WHERE c.id = %s""",
+            (user_id, channel_id)
+        )
+        row = cursor.fetchone()
+        memberships[channel_id] = row[0] if row else None
+    return memberships[channel_id]
+
+def load_reactions(conn, message_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    reactions: Dict[int, List[Dict[str, Any]]] = {}
+    if not message_ids:
+        return reactions
+    
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT message_id, emoji, COUNT(*), array_agg(user_id::text ORDER BY id)
+           FROM message_reactions
+           WHERE message_id = ANY(%s) AND message_type = 'channel'
+           GROUP BY message_id, emoji
+           ORDER BY message_id, MIN(id)""",
+        (message_ids,)
+    )
+    for message_id, emoji, count, users in cursor.fetchall():
+        reactions.setdefault(message_id, []).append({'emoji': emoji, 'count': count, 'users': users})
+    return reactions
+
+@traced
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return options_response('GET, POST, OPTIONS')
+    
+    user_id = authenticate(event)
+    if user_id is None:
+        return error_response(401, 'Требуется авторизация')
+    
+    conn = None
+    memberships: Dict[int, Optional[int]] = {}
+    
+    try:
+        if method == 'POST':
+            body = json.loads(event.get('body', '{}'))
+            action = body.get('action')
+            
+            if action == 'create_server':
+                name = str(body.get('name') or '').strip()
+                icon = body.get('icon') or '🎮'
+                
+                if not name:
+                    return error_response(400, 'Укажите название сервера')
+                
+                conn = get_connection()
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                cursor.execute(
+                    """WITH server AS (
+                           INSERT INTO servers (name, icon, owner_id) VALUES (%s, %s, %s)
+                           RETURNING id, name, icon, owner_id
+                       ), member AS (
+                           INSERT INTO server_members (server_id, user_id) SELECT id, owner_id FROM server
+                       ), created AS (
+                           INSERT INTO channels (server_id, name, type)
+                           SELECT server.id, c.name, c.type FROM server, unnest(%s::text[], %s::text[]) AS c(name, type)
+                           RETURNING id, name, type
+                       )
+                       SELECT s.*, (SELECT json_agg(created ORDER BY created.id) FROM created) AS channels
+                       FROM server s""",
+                    (name, icon, user_id, [c[0] for c in DEFAULT_CHANNELS], [c[1] for c in DEFAULT_CHANNELS])
+                )
+                server = cursor.fetchone()
+                
+                return json_response(200, {'success': True, 'server': dict(server)})
+            
+            elif action == 'join':
+                server_id = body.get('server_id')
+                
+                if not str(server_id).isdigit():
+                    return error_response(400, 'Укажите server_id')
+                
+                conn = get_connection()
+                cursor = conn.cursor()
+                cursor.execute(
+                    """INSERT INTO server_members (server_id, user_id)
+                       SELECT id, %s FROM servers WHERE id = %s
+                       ON CONFLICT (server_id, user_id) DO NOTHING
+                       RETURNING server_id""",
+                    (user_id, int(server_id))
+                )
+                joined = cursor.fetchone()
+                
+                if not joined:
+                    cursor.execute(
+                        "SELECT 1 FROM server_members WHERE server_id = %s AND user_id = %s",
+                        (int(server_id), user_id)
+                    )
+                    if not cursor.fetchone():
+                        return error_response(404, 'Сервер не найден')
+                
+                return json_response(200, {'success': True})
+            
+            elif action == 'create_channel':
+                server_id = body.get('server_id')
+                name = str(body.get('name') or '').strip()
+                channel_type = body.get('type', 'text')
+                
+                if not str(server_id).isdigit() or not name or channel_type not in ('text', 'voice'):
+                    return error_response(400, 'Заполните все поля')
+                
+                conn = get_connection()
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                cursor.execute(
+                    """INSERT INTO channels (server_id, name, type)
+                       SELECT id, %s, %s FROM servers WHERE id = %s AND owner_id = %s
+                       RETURNING id, server_id, name, type""",
+                    (name, channel_type, int(server_id), user_id)
+                )
+                channel = cursor.fetchone()
+                
+                if not channel:
+                    return error_response(403, 'Создавать каналы может только владелец сервера')
+                
+                return json_response(200, {'success': True, 'channel': dict(channel)})
+            
+            elif action == 'post':
+                channel_id = body.get('channel_id')
+                content = str(body.get('content') or '').strip()
+                
+                if not str(channel_id).isdigit() or not content:
+                    return error_response(400, 'Заполните все поля')
+                
+                conn = get_connection()
+                if channel_server(conn, memberships, user_id, int(channel_id)) is None:
+                    return error_response(403, 'Нет доступа к каналу')
+                
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                cursor.execute(
+                    """WITH message AS (
+                           INSERT INTO channel_messages (channel_id, user_id, content)
+                           VALUES (%s, %s, %s)
+                           RETURNING id, channel_id, user_id, content, created_at
+                       )
+                       SELECT m.*, u.username, u.discriminator, u.avatar
+                       FROM message m JOIN users u ON u.id = m.user_id""",
+                    (int(channel_id), user_id, content)
+                )
+                message = cursor.fetchone()
+                
+                return json_response(200, {
+                    'success': True,
+                    'message': {**message, 'reactions': []}
+                })
+        
+        elif method == 'GET':
+            params = event.get('queryStringParameters') or {}
+            
+            if params.get('channel_id'):
+                try:
+                    channel_id = int(params['channel_id'])
+                    before_id = int(params['before_id']) if params.get('before_id') else None
+                    after_id = int(params['after_id']) if params.get('after_id') else None
+                    limit = min(int(params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+                except ValueError:
+                    limit = 0
+                
+                if limit < 1 or (before_id is not None and after_id is not None):
+                    return error_response(400, 'Неверные параметры пагинации')
+                
+                conn = get_connection()
+                if channel_server(conn, memberships, user_id, channel_id) is None:
+                    return error_response(403, 'Нет доступа к каналу')
+                
+                # Условие по channel_id отсекает все секции, кроме одной
+                if after_id is not None:
+                    cursor_filter = "AND cm.id > %s"
+                    cursor_value = after_id
+                    order = "ASC"
+                else:
+                    cursor_filter = "AND cm.id < %s" if before_id is not None else ""
+                    cursor_value = before_id
+                    order = "DESC"
+                
+                query_params = [channel_id]
+                if cursor_filter:
+                    query_params.append(cursor_value)
+                query_params.append(limit + 1)
+                
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                cursor.execute(
+                    f"""SELECT cm.id, cm.channel_id, cm.user_id, cm.content, cm.created_at,
+                              u.username, u.discriminator, u.avatar
+                       FROM channel_messages cm
+                       JOIN users u ON u.id = cm.user_id
+                       WHERE cm.channel_id = %s
+                         {cursor_filter}
+                       ORDER BY cm.id {order}
+                       LIMIT %s""",
+                    query_params
+                )
+                messages = cursor.fetchall()
+                has_more = len(messages) > limit
+                messages = messages[:limit]
+                if order == "DESC":
+                    messages.reverse()
+                
+                reactions = load_reactions(conn, [msg['id'] for msg in messages])
+                
+                return json_response(200, {
+                    'messages': [{**msg, 'reactions': reactions.get(msg['id'], [])} for msg in messages],
+                    'has_more': has_more
+                })
+            
+            if params.get('server_id'):
+                if not params['server_id'].isdigit():
+                    return error_response(400, 'Укажите server_id')
+                
+                conn = get_connection()
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                cursor.execute(
+                    """SELECT c.id, c.server_id, c.name, c.type
+                       FROM channels c
+                       JOIN server_members m ON m.server_id = c.server_id AND m.user_id = %s
+                       WHERE c.server_id = %s
+                       ORDER BY c.id""",
+                    (user_id, int(params['server_id']))
+                )
+                channels = cursor.fetchall()
+                
+                return json_response(200, {'channels': [dict(c) for c in channels]})
+            
+            conn = get_connection()
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                """SELECT s.id, s.name, s.icon, s.owner_id
+                   FROM servers s
+                   JOIN server_members m ON m.server_id = s.id
+                   WHERE m.user_id = %s
+                   ORDER BY m.joined_at, s.id""",
+                (user_id,)
+            )
+            servers = cursor.fetchall()
+            
+            return json_response(200, {'servers': [dict(s) for s in servers]})
+        
+        return error_response(405, 'Метод не поддерживается')
+    
+    finally:
+        if conn is not None:
+            release_connection(conn)
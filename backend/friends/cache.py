@@ -0,0 +1,156 @@
+"""
+Business: Кэш графа друзей — множества id друзей, карточки профилей и поиск по Username#0000
+Args: FRIENDS_CACHE_URL (redis:// для общего кэша между экземплярами), FRIENDS_CACHE_TTL_SECONDS,
+      FRIENDS_STATUS_TTL_SECONDS, FRIENDS_CACHE_SIZE из окружения
+Returns: get_backend и функции ключей; сброс — invalidate_friends / invalidate_profile / invalidate_code
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+CACHE_URL = os.environ.get('FRIENDS_CACHE_URL', '')
+CACHE_TTL_SECONDS = float(os.environ.get('FRIENDS_CACHE_TTL_SECONDS', '60'))
+# Статусы и непрочитанные меняются часто — держим их коротко, 0 отключает
+STATUS_TTL_SECONDS = float(os.environ.get('FRIENDS_STATUS_TTL_SECONDS', '5'))
+CACHE_SIZE = int(os.environ.get('FRIENDS_CACHE_SIZE', '50000'))
+
+class LocalBackend:
+    """Кэш в памяти экземпляра функции: TTL + вытеснение давно не использованных записей."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._data: 'OrderedDict[str, Tuple[Any, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is None:
+                    continue
+                if now >= entry[1]:
+                    del self._data[key]
+                    continue
+                self._data.move_to_end(key)
+                found[key] = entry[0]
+        return found
+
+    def set_many(self, values: Dict[str, Any], ttl: float) -> None:
+        valid_until = time.monotonic() + ttl
+        with self._lock:
+            for key, value in values.items():
+                self._data[key] = (value, valid_until)
+                self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+class RedisBackend:
+    """Общий кэш для всех экземпляров: сброс после add/remove виден сразу везде."""
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        return {key: json.loads(raw) for key, raw in zip(keys, self.client.mget(keys)) if raw is not None}
+
+    def set_many(self, values: Dict[str, Any], ttl: float) -> None:
+        if not values:
+            return
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in values.items():
+            pipeline.set(key, json.dumps(value), px=int(ttl * 1000))
+        pipeline.execute()
+
+    def delete(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        if keys:
+            self.client.delete(*keys)
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if CACHE_URL and redis is not None:
+                    _backend = RedisBackend(CACHE_URL)
+                else:
+                    _backend = LocalBackend(CACHE_SIZE)
+    return _backend
+
+def set_backend(backend) -> None:
+    # Подмена хранилища, например LocalBackend вместо Redis при локальном прогоне
+    global _backend
+    _backend = backend
+
+def friends_key(user_id: int) -> str:
+    return f"friends:ids:{user_id}"
+
+def profile_key(user_id: int) -> str:
+    return f"friends:profile:{user_id}"
+
+def status_key(user_id: int) -> str:
+    return f"friends:status:{user_id}"
+
+def code_key(username: str, discriminator: str) -> str:
+    return f"friends:code:{username}#{discriminator}"
+
+def get_friend_ids(user_id: int) -> Optional[List[int]]:
+    return get_backend().get_many([friends_key(user_id)]).get(friends_key(user_id))
+
+def get_profiles(user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    found = get_backend().get_many(profile_key(i) for i in user_ids)
+    return {profile['id']: profile for profile in found.values()}
+
+def store_friends(user_id: int, friend_ids: List[int], profiles: List[Dict[str, Any]]) -> None:
+    backend = get_backend()
+    backend.set_many({friends_key(user_id): friend_ids}, CACHE_TTL_SECONDS)
+    store_profiles(profiles)
+
+def store_profiles(profiles: List[Dict[str, Any]]) -> None:
+    get_backend().set_many({profile_key(p['id']): p for p in profiles}, CACHE_TTL_SECONDS)
+
+def get_statuses(user_id: int) -> Optional[Dict[str, List[Any]]]:
+    if STATUS_TTL_SECONDS <= 0:
+        return None
+    return get_backend().get_many([status_key(user_id)]).get(status_key(user_id))
+
+def store_statuses(user_id: int, statuses: Dict[str, List[Any]]) -> None:
+    if STATUS_TTL_SECONDS > 0:
+        get_backend().set_many({status_key(user_id): statuses}, STATUS_TTL_SECONDS)
+
+def lookup_code(username: str, discriminator: str) -> Optional[int]:
+    return get_backend().get_many([code_key(username, discriminator)]).get(code_key(username, discriminator))
+
+def store_code(username: str, discriminator: str, user_id: int) -> None:
+    get_backend().set_many({code_key(username, discriminator): user_id}, CACHE_TTL_SECONDS)
+
+def invalidate_friends(*user_ids: int) -> None:
+    get_backend().delete([friends_key(i) for i in user_ids] + [status_key(i) for i in user_ids])
+
+def invalidate_profile(user_id: int) -> None:
+    get_backend().delete([profile_key(user_id)])
+
+def invalidate_code(username: str, discriminator: str) -> None:
+    get_backend().delete([code_key(username, discriminator)])
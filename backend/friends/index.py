@@ -6,29 +6,137 @@ Returns: HTTP response dict
 """
 
 import json
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from db import get_connection, release_connection
+from cache import (
+    get_friend_ids, get_profiles, store_friends, store_profiles, get_statuses, store_statuses,
+    lookup_code, store_code, invalidate_friends
+)
+from session import authenticate
+from response import json_response, error_response, options_response, rows_to_dicts
+from tracing import traced
+from typing import Dict, Any, List
 
+PROFILE_COLUMNS = ('id', 'username', 'discriminator', 'avatar', 'activity')
+REQUEST_COLUMNS = ('id', 'username', 'discriminator', 'avatar', 'created_at')
+SUGGESTION_COLUMNS = ('id', 'username', 'discriminator', 'avatar', 'mutual_count')
+STATUS_ORDER = {'online': 0, 'away': 1}
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+EVENTS_CHANNEL = 'dm_events'
+
+def mark_suggestions_dirty(cursor, user_id: int, friend_id: int) -> None:
+    # Общие друзья меняются у обоих и у их друзей — пересчитает воркер или первый запрос рекомендаций
+    cursor.execute(
+        """INSERT INTO friend_suggestions_dirty (user_id)
+           SELECT unnest(ARRAY[%s, %s])
+           UNION
+           SELECT friend_id FROM friendships WHERE user_id IN (%s, %s) AND status = 'accepted'
+           ON CONFLICT (user_id) DO UPDATE SET marked_at = EXCLUDED.marked_at""",
+        (user_id, friend_id, user_id, friend_id)
+    )
+
+def accept_request(cursor, user_id: int, friend_id: int) -> bool:
+    # Заявка friend_id -> user_id становится дружбой в обе стороны одной командой
+    cursor.execute(
+        """WITH accepted AS (
+               UPDATE friendships SET status = 'accepted'
+               WHERE user_id = %s AND friend_id = %s AND status = 'pending'
+               RETURNING user_id, friend_id
+           ), mirrored AS (
+               INSERT INTO friendships (user_id, friend_id, status)
+               SELECT friend_id, user_id, 'accepted' FROM accepted
+               ON CONFLICT (user_id, friend_id) DO UPDATE SET status = 'accepted'
+           )
+           SELECT pg_notify(%s, json_build_object(
+               'type', 'friend_accepted', 'user_id', friend_id, 'recipients', json_build_array(user_id)
+           )::text)
+           FROM accepted""",
+        (friend_id, user_id, EVENTS_CHANNEL)
+    )
+    if cursor.rowcount == 0:
+        return False
+    mark_suggestions_dirty(cursor, user_id, friend_id)
+    invalidate_friends(user_id, friend_id)
+    return True
+
+def load_friends(user_id: int) -> List[Dict[str, Any]]:
+    # Список друзей из кэша; соединение берём, только если чего-то в кэше нет
+    conn = None
+    
+    def cursor():
+        nonlocal conn
+        if conn is None:
+            conn = get_connection()
+        return conn.cursor()
+    
+    try:
+        friend_ids = get_friend_ids(user_id)
+        if friend_ids is None:
+            cur = cursor()
+            cur.execute(
+                """SELECT u.id, u.username, u.discriminator, u.avatar, u.activity
+                   FROM friendships f
+                   JOIN users u ON u.id = f.friend_id
+                   WHERE f.user_id = %s AND f.status = 'accepted'
+                   ORDER BY u.username ASC""",
+                (user_id,)
+            )
+            profiles = [dict(zip(PROFILE_COLUMNS, row)) for row in cur.fetchall()]
+            friend_ids = [p['id'] for p in profiles]
+            store_friends(user_id, friend_ids, profiles)
+            by_id = {p['id']: p for p in profiles}
+        else:
+            by_id = get_profiles(friend_ids)
+            missing = [i for i in friend_ids if i not in by_id]
+            if missing:
+                cur = cursor()
+                cur.execute(
+                    "SELECT id, username, discriminator, avatar, activity FROM users WHERE id = ANY(%s)",
+                    (missing,)
+                )
+                profiles = [dict(zip(PROFILE_COLUMNS, row)) for row in cur.fetchall()]
+                store_profiles(profiles)
+                by_id.update((p['id'], p) for p in profiles)
+        
+        if not friend_ids:
+            return []
+        
+        statuses = get_statuses(user_id)
+        if statuses is None:
+            cur = cursor()
+            cur.execute(
+                """SELECT ids.id, COALESCE(p.status, 'offline'), COALESCE(uc.count, 0)
+                   FROM unnest(%s::int[]) AS ids(id)
+                   LEFT JOIN presence p ON p.user_id = ids.id AND p.expires_at > now()
+                   LEFT JOIN unread_counters uc ON uc.user_id = %s AND uc.peer_id = ids.id""",
+                (friend_ids, user_id)
+            )
+            statuses = {str(friend_id): [status, unread] for friend_id, status, unread in cur.fetchall()}
+            store_statuses(user_id, statuses)
+    finally:
+        if conn is not None:
+            release_connection(conn)
+    
+    friends = [
+        {**by_id[i], 'status': statuses[str(i)][0], 'unread_count': statuses[str(i)][1]}
+        for i in friend_ids if i in by_id and str(i) in statuses
+    ]
+    # friend_ids уже в порядке имён из базы — устойчивая сортировка сохраняет его внутри статуса
+    friends.sort(key=lambda f: STATUS_ORDER.get(f['status'], 2))
+    return friends
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return options_response('GET, POST, DELETE, OPTIONS')
+    
+    user_id = authenticate(event)
+    if user_id is None:
+        return error_response(401, 'Требуется авторизация')
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    conn.autocommit = True
+    conn = None
     
     try:
         if method == 'POST':
@@ -36,121 +144,204 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             action = body.get('action')
             
             if action == 'add':
-                user_id = body.get('user_id')
                 friend_code = body.get('friend_code', '').strip()
                 
-                if not user_id or not friend_code:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Укажите friend_code'}),
-                        'isBase64Encoded': False
-                    }
+                if not friend_code:
+                    return error_response(400, 'Укажите friend_code')
                 
                 parts = friend_code.split('#')
                 if len(parts) != 2:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный формат кода (Username#0000)'}),
-                        'isBase64Encoded': False
-                    }
+                    return error_response(400, 'Неверный формат кода (Username#0000)')
                 
                 username, discriminator = parts
                 
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                # Пользователи не удаляются, поэтому найденный код можно кэшировать; промахи не кэшируем
+                conn = get_connection()
+                cursor = conn.cursor()
+                friend_id = lookup_code(username, discriminator)
+                if friend_id is None:
+                    cursor.execute(
+                        "SELECT id FROM users WHERE username = %s AND discriminator = %s",
+                        (username, discriminator)
+                    )
+                    row = cursor.fetchone()
+                    if not row:
+                        return error_response(404, 'Пользователь не найден')
+                    friend_id = row[0]
+                    store_code(username, discriminator, friend_id)
+                
+                if friend_id == user_id:
+                    return error_response(400, 'Нельзя добавить себя в друзья')
+                
                 cursor.execute(
-                    "SELECT id FROM users WHERE username = %s AND discriminator = %s",
-                    (username, discriminator)
+                    "SELECT user_id, status FROM friendships WHERE (user_id, friend_id) IN ((%s, %s), (%s, %s))",
+                    (user_id, friend_id, friend_id, user_id)
                 )
-                friend = cursor.fetchone()
-                
-                if not friend:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Пользователь не найден'}),
-                        'isBase64Encoded': False
-                    }
-                
-                if friend['id'] == int(user_id):
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Нельзя добавить себя в друзья'}),
-                        'isBase64Encoded': False
-                    }
+                links = {row[0]: row[1] for row in cursor.fetchall()}
+                mine, theirs = links.get(user_id), links.get(friend_id)
+                
+                # Заблокировавший не виден; свою блокировку нужно снять явно
+                if theirs == 'blocked':
+                    return error_response(404, 'Пользователь не найден')
+                if mine == 'blocked':
+                    return error_response(400, 'Сначала разблокируйте пользователя')
+                
+                if mine == 'accepted':
+                    status = 'accepted'
+                elif theirs == 'pending':
+                    # Встречная заявка — сразу принимаем
+                    accept_request(cursor, user_id, friend_id)
+                    status = 'accepted'
+                else:
+                    cursor.execute(
+                        """WITH request AS (
+                               INSERT INTO friendships (user_id, friend_id, status) VALUES (%s, %s, 'pending')
+                               ON CONFLICT (user_id, friend_id) DO NOTHING
+                               RETURNING user_id, friend_id
+                           )
+                           SELECT pg_notify(%s, json_build_object(
+                               'type', 'friend_request', 'from_id', user_id, 'recipients', json_build_array(friend_id)
+                           )::text)
+                           FROM request""",
+                        (user_id, friend_id, EVENTS_CHANNEL)
+                    )
+                    status = 'pending'
                 
+                return json_response(200, {'success': True, 'friend_id': friend_id, 'status': status})
+            
+            elif action in ('accept', 'decline', 'remove', 'block', 'unblock'):
+                try:
+                    friend_id = int(body.get('friend_id'))
+                except (TypeError, ValueError):
+                    return error_response(400, 'Укажите friend_id')
+                
+                if friend_id == user_id:
+                    return error_response(400, 'Нельзя указать себя')
+                
+                conn = get_connection()
+                cursor = conn.cursor()
+                
+                if action == 'accept':
+                    if not accept_request(cursor, user_id, friend_id):
+                        return error_response(404, 'Заявка не найдена')
+                
+                elif action == 'decline':
+                    cursor.execute(
+                        "DELETE FROM friendships WHERE user_id = %s AND friend_id = %s AND status = 'pending'",
+                        (friend_id, user_id)
+                    )
+                    if cursor.rowcount == 0:
+                        return error_response(404, 'Заявка не найдена')
+                
+                elif action == 'remove':
+                    # Обе стороны по уникальному индексу (user_id, friend_id); заодно отменяет свою заявку.
+                    # Чужую блокировку удаление не снимает
+                    cursor.execute(
+                        """DELETE FROM friendships
+                           WHERE (user_id, friend_id) IN ((%s, %s), (%s, %s)) AND status <> 'blocked'
+                           RETURNING status""",
+                        (user_id, friend_id, friend_id, user_id)
+                    )
+                    if any(row[0] == 'accepted' for row in cursor.fetchall()):
+                        mark_suggestions_dirty(cursor, user_id, friend_id)
+                        invalidate_friends(user_id, friend_id)
+                
+                elif action in ('block', 'unblock'):
+                    # Несуществующий пользователь упёрся бы во внешние ключи friendships и friend_suggestions_dirty
+                    cursor.execute(
+                        """SELECT f.status FROM users u
+                           LEFT JOIN friendships f ON f.user_id = %s AND f.friend_id = u.id
+                           WHERE u.id = %s""",
+                        (user_id, friend_id)
+                    )
+                    row = cursor.fetchone()
+                    if row is None:
+                        return error_response(404, 'Пользователь не найден')
+                    
+                    if action == 'block' and row[0] != 'blocked':
+                        # Друзья из списков общих друзей пересчитываются до удаления связи
+                        mark_suggestions_dirty(cursor, user_id, friend_id)
+                        cursor.execute(
+                            """WITH removed AS (
+                                   DELETE FROM friendships
+                                   WHERE user_id = %s AND friend_id = %s AND status <> 'blocked'
+                               )
+                               INSERT INTO friendships (user_id, friend_id, status) VALUES (%s, %s, 'blocked')
+                               ON CONFLICT (user_id, friend_id) DO UPDATE SET status = 'blocked'""",
+                            (friend_id, user_id, user_id, friend_id)
+                        )
+                        invalidate_friends(user_id, friend_id)
+                    
+                    elif action == 'unblock' and row[0] == 'blocked':
+                        cursor.execute(
+                            "DELETE FROM friendships WHERE user_id = %s AND friend_id = %s AND status = 'blocked'",
+                            (user_id, friend_id)
+                        )
+                        if cursor.rowcount:
+                            mark_suggestions_dirty(cursor, user_id, friend_id)
+                
+                return json_response(200, {'success': True})
+        
+        elif method == 'GET':
+            params = event.get('queryStringParameters') or {}
+            view = params.get('view')
+            
+            if view == 'requests':
+                conn = get_connection()
+                cursor = conn.cursor()
                 cursor.execute(
-                    """INSERT INTO friendships (user_id, friend_id, status) 
-                       VALUES (%s, %s, 'accepted'), (%s, %s, 'accepted') 
-                       ON CONFLICT (user_id, friend_id) DO NOTHING""",
-                    (user_id, friend['id'], friend['id'], user_id)
+                    """SELECT f.friend_id = %s AS incoming, u.id, u.username, u.discriminator, u.avatar, f.created_at
+                       FROM friendships f
+                       JOIN users u ON u.id = CASE WHEN f.friend_id = %s THEN f.user_id ELSE f.friend_id END
+                       WHERE f.status = 'pending' AND (f.friend_id = %s OR f.user_id = %s)
+                       ORDER BY f.created_at DESC""",
+                    (user_id, user_id, user_id, user_id)
                 )
+                requests = {'incoming': [], 'outgoing': []}
+                for incoming, *row in cursor.fetchall():
+                    requests['incoming' if incoming else 'outgoing'].append(dict(zip(REQUEST_COLUMNS, row)))
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'friend_id': friend['id']}),
-                    'isBase64Encoded': False
-                }
+                return json_response(200, requests)
             
-            elif action == 'remove':
-                user_id = body.get('user_id')
-                friend_id = body.get('friend_id')
+            if view == 'suggestions':
+                try:
+                    limit = min(int(params.get('limit') or DEFAULT_SUGGESTIONS), MAX_SUGGESTIONS)
+                except ValueError:
+                    limit = 0
+                
+                if limit < 1:
+                    return error_response(400, 'Неверный limit')
                 
+                # Рекомендации читаются из таблицы; пересчёт — воркером или здесь, если граф менялся
+                conn = get_connection()
                 cursor = conn.cursor()
                 cursor.execute(
-                    "DELETE FROM friendships WHERE (user_id = %s AND friend_id = %s) OR (user_id = %s AND friend_id = %s)",
-                    (user_id, friend_id, friend_id, user_id)
+                    "SELECT refresh_friend_suggestions(ARRAY[user_id]) FROM friend_suggestions_dirty WHERE user_id = %s",
+                    (user_id,)
+                )
+                cursor.execute(
+                    """SELECT u.id, u.username, u.discriminator, u.avatar, s.mutual_count
+                       FROM friend_suggestions s
+                       JOIN users u ON u.id = s.candidate_id
+                       WHERE s.user_id = %s
+                         AND NOT EXISTS (
+                             SELECT 1 FROM friendships x
+                             WHERE (x.user_id, x.friend_id) IN ((s.user_id, s.candidate_id), (s.candidate_id, s.user_id))
+                         )
+                       ORDER BY s.mutual_count DESC, s.candidate_id
+                       LIMIT %s""",
+                    (user_id, limit)
                 )
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'GET':
-            user_id = event.get('queryStringParameters', {}).get('user_id')
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Укажите user_id'}),
-                    'isBase64Encoded': False
-                }
+                return json_response(200, {'suggestions': rows_to_dicts(SUGGESTION_COLUMNS, cursor.fetchall())})
             
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(
-                """SELECT u.id, u.username, u.discriminator, u.avatar, u.status, u.activity,
-                          (SELECT COUNT(*) FROM direct_messages 
-                           WHERE sender_id = u.id AND recipient_id = %s AND read = FALSE) as unread_count
-                   FROM users u
-                   JOIN friendships f ON f.friend_id = u.id
-                   WHERE f.user_id = %s AND f.status = 'accepted'
-                   ORDER BY u.status DESC, u.username ASC""",
-                (user_id, user_id)
-            )
-            friends = cursor.fetchall()
+            # При полном попадании в кэш база не нужна
+            friends = load_friends(user_id)
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'friends': [dict(f) for f in friends]
-                }),
-                'isBase64Encoded': False
-            }
+            return json_response(200, {'friends': friends})
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
+        return error_response(405, 'Метод не поддерживается')
     
     finally:
-        conn.close()
+        if conn is not None:
+            release_connection(conn)
@@ -0,0 +1,68 @@
+"""
+Business: Сборка HTTP-ответов функции — готовые заголовки и быстрая сериализация в JSON
+Args: payload — dict/list; даты сериализуются в ISO 8601 без ручного isoformat
+Returns: json_response / error_response / options_response и rows_to_dicts для списков из кортежей
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Заголовки собраны один раз и неизменяемы; каждый ответ получает свою копию — правки платформы или
+# вызывающего кода не протекают в следующие ответы
+JSON_HEADERS = MappingProxyType({'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'})
+_options_headers: Dict[str, MappingProxyType] = {}
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+if orjson is not None:
+    def dumps(payload: Any) -> str:
+        # datetime, dict-подклассы (RealDictRow) и кортежи orjson сериализует сам, в default попадает остальное
+        return orjson.dumps(payload, default=_default).decode('utf-8')
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(payload: Any) -> str:
+        return _encoder.encode(payload)
+
+def rows_to_dicts(columns: Sequence[str], rows: Iterable[Tuple]) -> List[Dict[str, Any]]:
+    # Для больших выборок: кортежи обычного курсора дешевле RealDictRow и копий {**dict(row)}
+    return [dict(zip(columns, row)) for row in rows]
+
+def json_response(status: int, payload: Any) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': dict(JSON_HEADERS),
+        'body': dumps(payload),
+        'isBase64Encoded': False
+    }
+
+def error_response(status: int, message: str) -> Dict[str, Any]:
+    return json_response(status, {'error': message})
+
+def options_response(methods: str) -> Dict[str, Any]:
+    if methods not in _options_headers:
+        _options_headers[methods] = MappingProxyType({
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': methods,
+            'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+            'Access-Control-Max-Age': '86400'
+        })
+    return {
+        'statusCode': 200,
+        'headers': dict(_options_headers[methods]),
+        'body': '',
+        'isBase64Encoded': False
+    }
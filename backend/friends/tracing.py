@@ -0,0 +1,115 @@
+"""
+Business: Учёт SQL-запросов за вызов функции — число, время, самые дорогие запросы
+Args: DB_TRACE, DB_TRACE_SLOW_MS, DB_TRACE_TOP из окружения
+Returns: TracingConnection для пула и декоратор traced для handler; сводка пишется в лог одной JSON-строкой
+"""
+
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import psycopg2.extensions
+from typing import Any, Callable, Dict, Optional
+
+ENABLED = os.environ.get('DB_TRACE', '').lower() in ('1', 'true', 'yes')
+SLOW_MS = float(os.environ.get('DB_TRACE_SLOW_MS', '100'))
+TOP = int(os.environ.get('DB_TRACE_TOP', '5'))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACES = re.compile(r'\s+')
+# Списки VALUES из execute_values и IN (...) схлопываем, чтобы пачки разного размера совпадали
+_TUPLE = r'\( ?(?:\?|%s)(?: ?, ?(?:\?|%s))* ?\)'
+_TUPLES = re.compile(_TUPLE + r'(?: ?, ?' + _TUPLE + r')+')
+
+_state = threading.local()
+_cursor_classes: Dict[type, type] = {}
+
+def normalize(query: Any) -> str:
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        # psycopg2.sql.Composed и прочее — берём как есть
+        query = str(query)
+    query = _STRING.sub('?', query)
+    query = _NUMBER.sub('?', query)
+    query = _SPACES.sub(' ', query).strip()
+    return _TUPLES.sub('(...)', query)
+
+def _record(query: Any, elapsed_ms: float) -> None:
+    stats = getattr(_state, 'stats', None)
+    if stats is None:
+        return
+    key = normalize(query)
+    entry = stats.setdefault(key, [0, 0.0, 0.0])
+    entry[0] += 1
+    entry[1] += elapsed_ms
+    entry[2] = max(entry[2], elapsed_ms)
+
+def _timed(method: Callable) -> Callable:
+    def wrapper(self, query, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(self, query, *args, **kwargs)
+        finally:
+            _record(query, (time.perf_counter() - started) * 1000)
+    return wrapper
+
+def _tracing_cursor(factory: type) -> type:
+    if factory not in _cursor_classes:
+        _cursor_classes[factory] = type(
+            f"Tracing{factory.__name__}",
+            (factory,),
+            {'execute': _timed(factory.execute), 'executemany': _timed(factory.executemany)}
+        )
+    return _cursor_classes[factory]
+
+class TracingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=_tracing_cursor(factory), **kwargs)
+
+def connection_factory() -> Optional[type]:
+    return TracingConnection if ENABLED else None
+
+def _emit(context: Any, status: Optional[int], duration_ms: float) -> None:
+    stats = _state.stats
+    statements = sorted(stats.items(), key=lambda item: item[1][1], reverse=True)
+    summary = {
+        'event': 'db_trace',
+        'request_id': getattr(context, 'request_id', None),
+        'function': getattr(context, 'function_name', None),
+        'status': status,
+        'duration_ms': round(duration_ms, 2),
+        'queries': sum(entry[0] for entry in stats.values()),
+        'db_ms': round(sum(entry[1] for entry in stats.values()), 2),
+        'slow_queries': [sql for sql, entry in statements if entry[2] >= SLOW_MS],
+        'top': [
+            {'sql': sql, 'calls': calls, 'total_ms': round(total, 2), 'max_ms': round(peak, 2)}
+            for sql, (calls, total, peak) in statements[:TOP]
+        ]
+    }
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr, flush=True)
+
+def traced(handler: Callable) -> Callable:
+    # Без DB_TRACE handler возвращается как есть — накладных расходов нет
+    if not ENABLED:
+        return handler
+
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        _state.stats = {}
+        started = time.perf_counter()
+        status = None
+        try:
+            result = handler(event, context)
+            status = result.get('statusCode') if isinstance(result, dict) else None
+            return result
+        finally:
+            _emit(context, status, (time.perf_counter() - started) * 1000)
+            _state.stats = None
+
+    return wrapper
@@ -0,0 +1,132 @@
+"""
+Business: Выгрузка всей переписки в сжатые NDJSON-части без загрузки истории в память
+Args: EXPORT_DIR, EXPORT_BATCH_SIZE, EXPORT_CHUNK_ROWS, EXPORT_TTL_SECONDS из окружения
+Returns: export_conversation пишет части и манифест, read_chunk отдаёт одну часть владельцу выгрузки
+"""
+
+import gzip
+import json
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+EXPORT_DIR = os.environ.get('EXPORT_DIR') or os.path.join(tempfile.gettempdir(), 'dm-exports')
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', '10000'))
+EXPORT_TTL_SECONDS = float(os.environ.get('EXPORT_TTL_SECONDS', '3600'))
+EXPORT_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+def _chunk_name(index: int) -> str:
+    return f"part-{index:05d}.ndjson.gz"
+
+def _sweep_expired() -> None:
+    try:
+        names = os.listdir(EXPORT_DIR)
+    except OSError:
+        return
+    deadline = time.time() - EXPORT_TTL_SECONDS
+    for name in names:
+        path = os.path.join(EXPORT_DIR, name)
+        # Соседний экземпляр мог удалить каталог между listdir и getmtime
+        try:
+            if EXPORT_ID_PATTERN.match(name) and os.path.getmtime(path) < deadline:
+                shutil.rmtree(path)
+        except OSError:
+            continue
+
+def export_conversation(conn, user_id: int, friend_id: int) -> Dict[str, Any]:
+    _sweep_expired()
+    export_id = secrets.token_hex(16)
+    export_dir = os.path.join(EXPORT_DIR, export_id)
+    os.makedirs(export_dir)
+
+    chunks = []
+    rows = 0
+    current = None
+    chunk_rows = 0
+
+    # Серверный курсор живёт только в транзакции; строки NDJSON собирает сам Postgres, архив включён
+    conn.autocommit = False
+    try:
+        cursor = conn.cursor(name=f"export_{export_id}")
+        cursor.itersize = EXPORT_BATCH_SIZE
+        cursor.execute(
+            """SELECT json_build_object(
+                   'id', dm.id, 'sender_id', dm.sender_id, 'recipient_id', dm.recipient_id,
+                   'content', dm.content, 'created_at', dm.created_at,
+                   'reactions', CASE WHEN dm.reaction_count > 0 THEN (
+                       SELECT json_agg(json_build_object('emoji', r.emoji, 'count', r.count, 'users', r.users))
+                       FROM (
+                           SELECT emoji, COUNT(*) AS count, array_agg(user_id::text ORDER BY id) AS users
+                           FROM message_reactions
+                           WHERE message_id = dm.id AND message_type = 'direct'
+                           GROUP BY emoji
+                           ORDER BY MIN(id)
+                       ) r
+                   ) ELSE '[]'::json END
+               )::text
+               FROM (
+                   SELECT id, sender_id, recipient_id, content, created_at, reaction_count FROM direct_messages
+                   WHERE LEAST(sender_id, recipient_id) = %s AND GREATEST(sender_id, recipient_id) = %s
+                   UNION ALL
+                   SELECT id, sender_id, recipient_id, content, created_at, reaction_count FROM direct_messages_archive
+                   WHERE LEAST(sender_id, recipient_id) = %s AND GREATEST(sender_id, recipient_id) = %s
+               ) dm
+               ORDER BY dm.id""",
+            (min(user_id, friend_id), max(user_id, friend_id)) * 2
+        )
+        for (line,) in cursor:
+            if current is None:
+                name = _chunk_name(len(chunks))
+                current = gzip.open(os.path.join(export_dir, name), 'wt', encoding='utf-8')
+                chunks.append({'name': name, 'rows': 0})
+                chunk_rows = 0
+            current.write(line)
+            current.write('\n')
+            chunk_rows += 1
+            rows += 1
+            if chunk_rows >= EXPORT_CHUNK_ROWS:
+                current.close()
+                chunks[-1]['rows'] = chunk_rows
+                current = None
+        cursor.close()
+    finally:
+        if current is not None:
+            current.close()
+            chunks[-1]['rows'] = chunk_rows
+        conn.rollback()
+        conn.autocommit = True
+
+    for chunk in chunks:
+        chunk['bytes'] = os.path.getsize(os.path.join(export_dir, chunk['name']))
+
+    manifest = {
+        'export_id': export_id,
+        'user_id': user_id,
+        'friend_id': friend_id,
+        'rows': rows,
+        'chunks': chunks,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    }
+    with open(os.path.join(export_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    return manifest
+
+def read_chunk(user_id: int, export_id: str, index: int) -> Optional[bytes]:
+    # None — нет такой выгрузки, части или выгрузка чужая
+    if not EXPORT_ID_PATTERN.match(export_id) or index < 0:
+        return None
+    export_dir = os.path.join(EXPORT_DIR, export_id)
+    try:
+        with open(os.path.join(export_dir, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['user_id'] != user_id or index >= len(manifest['chunks']):
+            return None
+        with open(os.path.join(export_dir, manifest['chunks'][index]['name']), 'rb') as f:
+            return f.read()
+    except (OSError, ValueError, KeyError):
+        return None
@@ -5,30 +5,103 @@ Args: event - dict с httpMethod, body, queryStringParameters
 Returns: HTTP response dict
 """
 
+import base64
 import json
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from psycopg2.extras import RealDictCursor, execute_values
+from db import get_connection, release_connection
+from export import export_conversation, read_chunk
+from session import authenticate
+from response import json_response, error_response, options_response, rows_to_dicts
+from tracing import traced
+from typing import Dict, Any, List, Optional, Tuple
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_SIZE = 500
+MAX_EMOJI_LENGTH = 10
+MAX_INT4 = 2 ** 31 - 1
+DEFAULT_SEARCH_SIZE = 20
+HEADLINE_OPTIONS = 'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20, MinWords=5'
+EVENTS_CHANNEL = 'dm_events'
+BLOCKED_ERROR = 'Переписка с этим пользователем недоступна'
+HISTORY_COLUMNS = ('id', 'sender_id', 'recipient_id', 'content', 'created_at', 'reaction_count', 'read',
+                   'username', 'discriminator', 'avatar')
+
+def load_reactions(conn, message_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    reactions: Dict[int, List[Dict[str, Any]]] = {}
+    if not message_ids:
+        return reactions
+    
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT message_id, emoji, COUNT(*), array_agg(user_id::text ORDER BY id)
+           FROM message_reactions
+           WHERE message_id = ANY(%s) AND message_type = 'direct'
+           GROUP BY message_id, emoji
+           ORDER BY message_id, MIN(id)""",
+        (message_ids,)
+    )
+    for message_id, emoji, count, users in cursor.fetchall():
+        reactions.setdefault(message_id, []).append({'emoji': emoji, 'count': count, 'users': users})
+    return reactions
+
+def history_query(user_id: int, friend_id: int, before_id: Optional[int], after_id: Optional[int],
+                  limit: int) -> Tuple[str, List[Any], str]:
+    # after_id — новые сообщения для опроса, иначе — страница от конца (before_id) вниз
+    if after_id is not None:
+        cursor_filter = "AND dm.id > %s"
+        cursor_value = after_id
+        order = "ASC"
+    else:
+        cursor_filter = "AND dm.id < %s" if before_id is not None else ""
+        cursor_value = before_id
+        order = "DESC"
+    
+    # Пара нормализована как в idx_direct_messages_conversation — страница читается прямо из индекса.
+    # Старые сообщения воркер переносит в архив: каждая таблица отдаёт не больше страницы по своему индексу
+    pair_params: List[Any] = [min(user_id, friend_id), max(user_id, friend_id)]
+    if cursor_filter:
+        pair_params.append(cursor_value)
+    pair_params.append(limit + 1)
+    
+    sql = f"""SELECT dm.id, dm.sender_id, dm.recipient_id, dm.content, dm.created_at, dm.reaction_count,
+                    dm.id <= COALESCE(cr.last_read_message_id, 0) AS read,
+                    u.username, u.discriminator, u.avatar
+             FROM (
+                 (SELECT dm.id, dm.sender_id, dm.recipient_id, dm.content, dm.created_at, dm.reaction_count
+                  FROM direct_messages dm
+                  WHERE LEAST(dm.sender_id, dm.recipient_id) = %s
+                    AND GREATEST(dm.sender_id, dm.recipient_id) = %s
+                    {cursor_filter}
+                  ORDER BY dm.id {order}
+                  LIMIT %s)
+                 UNION ALL
+                 (SELECT dm.id, dm.sender_id, dm.recipient_id, dm.content, dm.created_at, dm.reaction_count
+                  FROM direct_messages_archive dm
+                  WHERE LEAST(dm.sender_id, dm.recipient_id) = %s
+                    AND GREATEST(dm.sender_id, dm.recipient_id) = %s
+                    {cursor_filter}
+                  ORDER BY dm.id {order}
+                  LIMIT %s)
+             ) dm
+             JOIN users u ON u.id = dm.sender_id
+             LEFT JOIN conversation_reads cr ON cr.user_id = dm.recipient_id AND cr.peer_id = dm.sender_id
+             ORDER BY dm.id {order}
+             LIMIT %s"""
+    return sql, pair_params * 2 + [limit + 1], order
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return options_response('GET, POST, OPTIONS')
+    
+    user_id = authenticate(event)
+    if user_id is None:
+        return error_response(401, 'Требуется авторизация')
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    conn.autocommit = True
+    conn = None
     
     try:
         if method == 'POST':
@@ -36,146 +109,516 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             action = body.get('action')
             
             if action == 'send':
-                sender_id = body.get('sender_id')
+                sender_id = user_id
                 recipient_id = body.get('recipient_id')
                 content = body.get('content', '').strip()
                 
-                if not sender_id or not recipient_id or not content:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Заполните все поля'}),
-                        'isBase64Encoded': False
-                    }
+                if not recipient_id or not content:
+                    return error_response(400, 'Заполните все поля')
                 
+                # Блокировка в любую сторону запрещает переписку — тогда команда ничего не вставляет
+                conn = get_connection()
                 cursor = conn.cursor(cursor_factory=RealDictCursor)
                 cursor.execute(
-                    """INSERT INTO direct_messages (sender_id, recipient_id, content) 
-                       VALUES (%s, %s, %s) 
-                       RETURNING id, sender_id, recipient_id, content, created_at, read""",
-                    (sender_id, recipient_id, content)
+                    """WITH message AS (
+                           INSERT INTO direct_messages (sender_id, recipient_id, content) 
+                           SELECT %s, %s, %s
+                           WHERE NOT EXISTS (
+                               SELECT 1 FROM friendships
+                               WHERE (user_id, friend_id) IN ((%s, %s), (%s, %s)) AND status = 'blocked'
+                           )
+                           RETURNING id, sender_id, recipient_id, content, created_at, FALSE AS read
+                       ), counter AS (
+                           INSERT INTO unread_counters (user_id, peer_id, count)
+                           SELECT recipient_id, sender_id, 1 FROM message
+                           ON CONFLICT (user_id, peer_id) DO UPDATE SET count = unread_counters.count + 1
+                       )
+                       SELECT m.*, u.username, u.discriminator, u.avatar
+                       FROM message m
+                       JOIN users u ON u.id = m.sender_id
+                       CROSS JOIN LATERAL (
+                           SELECT pg_notify(%s, json_build_object(
+                               'type', 'message', 'message_id', m.id,
+                               'sender_id', m.sender_id, 'recipient_id', m.recipient_id,
+                               'recipients', json_build_array(m.sender_id, m.recipient_id)
+                           )::text)
+                       ) notify""",
+                    (sender_id, recipient_id, content, sender_id, recipient_id, recipient_id, sender_id, EVENTS_CHANNEL)
                 )
                 message = cursor.fetchone()
-                
-                cursor.execute(
-                    "SELECT id, username, discriminator, avatar FROM users WHERE id = %s",
-                    (sender_id,)
-                )
-                sender = cursor.fetchone()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'message': {
-                            **dict(message),
-                            'sender': dict(sender),
-                            'created_at': message['created_at'].isoformat() if message['created_at'] else None
-                        }
-                    }, default=str),
-                    'isBase64Encoded': False
+                if message is None:
+                    return error_response(403, BLOCKED_ERROR)
+                sender = {
+                    'id': message['sender_id'],
+                    'username': message.pop('username'),
+                    'discriminator': message.pop('discriminator'),
+                    'avatar': message.pop('avatar')
                 }
+                
+                return json_response(200, {
+                    'success': True,
+                    'message': {**message, 'sender': sender}
+                })
             
             elif action == 'add_reaction':
                 message_id = body.get('message_id')
-                user_id = body.get('user_id')
                 emoji = body.get('emoji')
                 
+                if not message_id or not emoji:
+                    return error_response(400, 'Заполните все поля')
+                
+                # Реакция не ставится, если кто-то из участников переписки и автор реакции заблокировали друг друга
+                conn = get_connection()
                 cursor = conn.cursor()
                 cursor.execute(
-                    """INSERT INTO message_reactions (message_id, message_type, user_id, emoji) 
-                       VALUES (%s, 'direct', %s, %s) 
-                       ON CONFLICT (message_id, message_type, user_id, emoji) DO NOTHING""",
-                    (message_id, user_id, emoji)
+                    """WITH blocked AS (
+                           SELECT EXISTS (
+                               SELECT 1
+                               FROM (
+                                   SELECT sender_id, recipient_id FROM direct_messages WHERE id = %s
+                                   UNION ALL
+                                   SELECT sender_id, recipient_id FROM direct_messages_archive WHERE id = %s
+                               ) m
+                               JOIN friendships f ON f.status = 'blocked' AND (
+                                   (f.user_id = %s AND f.friend_id IN (m.sender_id, m.recipient_id))
+                                   OR (f.friend_id = %s AND f.user_id IN (m.sender_id, m.recipient_id))
+                               )
+                           ) AS blocked
+                       ), inserted AS (
+                           INSERT INTO message_reactions (message_id, message_type, user_id, emoji) 
+                           SELECT %s, 'direct', %s, %s FROM blocked WHERE NOT blocked.blocked
+                           ON CONFLICT (message_id, message_type, user_id, emoji) DO NOTHING
+                           RETURNING message_id
+                       ), updated AS (
+                           UPDATE direct_messages SET reaction_count = reaction_count + 1
+                           WHERE id IN (SELECT message_id FROM inserted)
+                           RETURNING id, sender_id, recipient_id
+                       ), updated_archive AS (
+                           UPDATE direct_messages_archive SET reaction_count = reaction_count + 1
+                           WHERE id IN (SELECT message_id FROM inserted)
+                           RETURNING id, sender_id, recipient_id
+                       ), notify AS (
+                           SELECT pg_notify(%s, json_build_object(
+                               'type', 'reaction_added', 'message_id', id, 'user_id', %s, 'emoji', %s,
+                               'recipients', json_build_array(sender_id, recipient_id)
+                           )::text)
+                           FROM (SELECT * FROM updated UNION ALL SELECT * FROM updated_archive) updated
+                       )
+                       SELECT blocked FROM blocked
+                       CROSS JOIN (SELECT COUNT(*) FROM notify) notified""",
+                    (message_id, message_id, user_id, user_id, message_id, user_id, emoji, EVENTS_CHANNEL, user_id, emoji)
                 )
+                if cursor.fetchone()[0]:
+                    return error_response(403, BLOCKED_ERROR)
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
+                return json_response(200, {'success': True})
             
             elif action == 'remove_reaction':
                 message_id = body.get('message_id')
-                user_id = body.get('user_id')
                 emoji = body.get('emoji')
                 
+                if not message_id or not emoji:
+                    return error_response(400, 'Заполните все поля')
+                
+                conn = get_connection()
                 cursor = conn.cursor()
                 cursor.execute(
-                    """DELETE FROM message_reactions 
-                       WHERE message_id = %s AND message_type = 'direct' AND user_id = %s AND emoji = %s""",
-                    (message_id, user_id, emoji)
+                    """WITH deleted AS (
+                           DELETE FROM message_reactions 
+                           WHERE message_id = %s AND message_type = 'direct' AND user_id = %s AND emoji = %s
+                           RETURNING message_id
+                       ), updated AS (
+                           UPDATE direct_messages SET reaction_count = GREATEST(reaction_count - 1, 0)
+                           WHERE id IN (SELECT message_id FROM deleted)
+                           RETURNING id, sender_id, recipient_id
+                       ), updated_archive AS (
+                           UPDATE direct_messages_archive SET reaction_count = GREATEST(reaction_count - 1, 0)
+                           WHERE id IN (SELECT message_id FROM deleted)
+                           RETURNING id, sender_id, recipient_id
+                       )
+                       SELECT pg_notify(%s, json_build_object(
+                           'type', 'reaction_removed', 'message_id', id, 'user_id', %s, 'emoji', %s,
+                           'recipients', json_build_array(sender_id, recipient_id)
+                       )::text)
+                       FROM (SELECT * FROM updated UNION ALL SELECT * FROM updated_archive) updated""",
+                    (message_id, user_id, emoji, EVENTS_CHANNEL, user_id, emoji)
                 )
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
+                return json_response(200, {'success': True})
+            
+            elif action == 'send_batch':
+                items = body.get('messages')
+                
+                if not isinstance(items, list) or not items or len(items) > MAX_BATCH_SIZE:
+                    return error_response(400, f'Передайте от 1 до {MAX_BATCH_SIZE} сообщений')
+                
+                results: List[Dict[str, Any]] = [{'index': i, 'success': False} for i in range(len(items))]
+                valid = []
+                for i, item in enumerate(items):
+                    recipient_id = item.get('recipient_id') if isinstance(item, dict) else None
+                    content = str(item.get('content') or '').strip() if isinstance(item, dict) else ''
+                    if not str(recipient_id).isdigit() or not content:
+                        results[i]['error'] = 'Заполните все поля'
+                    else:
+                        valid.append((i, int(recipient_id), content))
+                
+                if valid:
+                    conn = get_connection()
+                    cursor = conn.cursor(cursor_factory=RealDictCursor)
+                    # Получатели одним запросом — заодно с блокировками в любую сторону
+                    cursor.execute(
+                        """SELECT u.id, EXISTS (
+                               SELECT 1 FROM friendships f
+                               WHERE (f.user_id, f.friend_id) IN ((u.id, %s), (%s, u.id)) AND f.status = 'blocked'
+                           ) AS blocked
+                           FROM users u WHERE u.id = ANY(%s)""",
+                        (user_id, user_id, list({recipient_id for _, recipient_id, _ in valid}))
+                    )
+                    recipients = {row['id']: row['blocked'] for row in cursor.fetchall()}
+                    for i, recipient_id, _ in valid:
+                        if recipient_id not in recipients:
+                            results[i]['error'] = 'Получатель не найден'
+                        elif recipients[recipient_id]:
+                            results[i]['error'] = BLOCKED_ERROR
+                    valid = [item for item in valid if recipients.get(item[1]) is False]
+                
+                if valid:
+                    # Одна команда: сообщения, счётчики непрочитанных и по одному событию на собеседника
+                    rows = execute_values(
+                        cursor,
+                        f"""WITH message AS (
+                               INSERT INTO direct_messages (sender_id, recipient_id, content)
+                               VALUES %s
+                               RETURNING id, sender_id, recipient_id, content, created_at, FALSE AS read
+                           ), counter AS (
+                               INSERT INTO unread_counters (user_id, peer_id, count)
+                               SELECT recipient_id, sender_id, COUNT(*) FROM message GROUP BY recipient_id, sender_id
+                               ON CONFLICT (user_id, peer_id) DO UPDATE SET count = unread_counters.count + EXCLUDED.count
+                           ), notify AS (
+                               SELECT pg_notify('{EVENTS_CHANNEL}', json_build_object(
+                                   'type', 'message', 'message_id', MAX(id),
+                                   'sender_id', sender_id, 'recipient_id', recipient_id,
+                                   'recipients', json_build_array(sender_id, recipient_id)
+                               )::text)
+                               FROM message GROUP BY sender_id, recipient_id
+                           )
+                           SELECT m.* FROM message m
+                           CROSS JOIN (SELECT COUNT(*) FROM notify) notified
+                           ORDER BY m.id""",
+                        [(user_id, recipient_id, content) for _, recipient_id, content in valid],
+                        page_size=len(valid),
+                        fetch=True
+                    )
+                    # id выдаются в порядке VALUES, поэтому строки сопоставляются с запросом по порядку
+                    for (i, _, _), message in zip(valid, rows):
+                        results[i] = {'index': i, 'success': True, 'message': message}
+                
+                return json_response(200, {'success': True, 'results': results})
+            
+            elif action == 'reactions_batch':
+                items = body.get('reactions')
+                
+                if not isinstance(items, list) or not items or len(items) > MAX_BATCH_SIZE:
+                    return error_response(400, f'Передайте от 1 до {MAX_BATCH_SIZE} реакций')
+                
+                results = [{'index': i, 'success': False} for i in range(len(items))]
+                # Для пары (сообщение, эмодзи) действует последняя операция в пакете
+                latest: Dict[Any, int] = {}
+                for i, item in enumerate(items):
+                    message_id = item.get('message_id') if isinstance(item, dict) else None
+                    emoji = item.get('emoji') if isinstance(item, dict) else None
+                    op = item.get('op', 'add') if isinstance(item, dict) else None
+                    if not message_id or not emoji or op not in ('add', 'remove'):
+                        results[i]['error'] = 'Заполните все поля'
+                        continue
+                    # Одно неподходящее значение уронило бы весь VALUES — отсекаем его здесь, в ответе пункта
+                    if isinstance(message_id, str) and message_id.isdecimal():
+                        message_id = int(message_id)
+                    if type(message_id) is not int or not 0 < message_id <= MAX_INT4:
+                        results[i]['error'] = 'Неверный message_id'
+                        continue
+                    if not isinstance(emoji, str) or len(emoji) > MAX_EMOJI_LENGTH:
+                        results[i]['error'] = f'Эмодзи — строка не длиннее {MAX_EMOJI_LENGTH} символов'
+                        continue
+                    key = (message_id, emoji)
+                    if key in latest:
+                        results[latest[key]] = {'index': latest[key], 'success': True, 'applied': False}
+                    latest[key] = i
+                
+                if latest:
+                    conn = get_connection()
+                    cursor = conn.cursor()
+                    rows = execute_values(
+                        cursor,
+                        f"""WITH items (message_id, emoji, op, user_id) AS (
+                               VALUES %s
+                           ), added AS (
+                               INSERT INTO message_reactions (message_id, message_type, user_id, emoji)
+                               SELECT i.message_id, 'direct', i.user_id, i.emoji FROM items i
+                               WHERE i.op = 'add' AND NOT EXISTS (
+                                   -- Как в add_reaction: с заблокированными участниками переписки реакции не ставятся
+                                   SELECT 1
+                                   FROM (
+                                       SELECT sender_id, recipient_id FROM direct_messages WHERE id = i.message_id
+                                       UNION ALL
+                                       SELECT sender_id, recipient_id FROM direct_messages_archive WHERE id = i.message_id
+                                   ) m
+                                   JOIN friendships f ON f.status = 'blocked' AND (
+                                       (f.user_id = i.user_id AND f.friend_id IN (m.sender_id, m.recipient_id))
+                                       OR (f.friend_id = i.user_id AND f.user_id IN (m.sender_id, m.recipient_id))
+                                   )
+                               )
+                               ON CONFLICT (message_id, message_type, user_id, emoji) DO NOTHING
+                               RETURNING message_id, emoji, user_id
+                           ), removed AS (
+                               DELETE FROM message_reactions r
+                               USING items i
+                               WHERE i.op = 'remove' AND r.message_id = i.message_id AND r.message_type = 'direct'
+                                 AND r.user_id = i.user_id AND r.emoji = i.emoji
+                               RETURNING r.message_id, r.emoji, r.user_id
+                           ), changes AS (
+                               SELECT message_id, emoji, user_id, 1 AS delta FROM added
+                               UNION ALL
+                               SELECT message_id, emoji, user_id, -1 AS delta FROM removed
+                           ), deltas AS (
+                               SELECT message_id, SUM(delta) AS delta FROM changes GROUP BY message_id
+                           ), updated_hot AS (
+                               UPDATE direct_messages dm
+                               SET reaction_count = GREATEST(dm.reaction_count + d.delta, 0)
+                               FROM deltas d
+                               WHERE dm.id = d.message_id
+                               RETURNING dm.id, dm.sender_id, dm.recipient_id, d.delta
+                           ), updated_archive AS (
+                               UPDATE direct_messages_archive dm
+                               SET reaction_count = GREATEST(dm.reaction_count + d.delta, 0)
+                               FROM deltas d
+                               WHERE dm.id = d.message_id
+                               RETURNING dm.id, dm.sender_id, dm.recipient_id, d.delta
+                           ), updated AS (
+                               SELECT * FROM updated_hot UNION ALL SELECT * FROM updated_archive
+                           ), notify AS (
+                               -- Событие на каждую изменённую пару (сообщение, эмодзи), как в одиночных действиях;
+                               -- user_id приходит из строк реакций — execute_values не принимает других параметров
+                               SELECT pg_notify('{EVENTS_CHANNEL}', json_build_object(
+                                   'type', CASE WHEN c.delta > 0 THEN 'reaction_added' ELSE 'reaction_removed' END,
+                                   'message_id', c.message_id, 'user_id', c.user_id, 'emoji', c.emoji,
+                                   'recipients', json_build_array(u.sender_id, u.recipient_id)
+                               )::text)
+                               FROM changes c
+                               JOIN updated u ON u.id = c.message_id
+                           )
+                           SELECT message_id, emoji FROM changes
+                           CROSS JOIN (SELECT COUNT(*) FROM notify) notified""",
+                        [(message_id, emoji, items[i].get('op', 'add'), user_id) for (message_id, emoji), i in latest.items()],
+                        template='(%s::integer, %s::varchar, %s::text, %s::integer)',
+                        page_size=len(latest),
+                        fetch=True
+                    )
+                    applied = {(message_id, emoji) for message_id, emoji in rows}
+                    for key, i in latest.items():
+                        results[i] = {'index': i, 'success': True, 'applied': key in applied}
+                
+                return json_response(200, {'success': True, 'results': results})
+            
+            elif action == 'search':
+                query = str(body.get('query') or '').strip()
+                friend_id = body.get('friend_id')
+                
+                try:
+                    friend_id = int(friend_id) if friend_id else None
+                    limit = min(int(body.get('limit') or DEFAULT_SEARCH_SIZE), MAX_PAGE_SIZE)
+                    offset = int(body.get('offset') or 0)
+                except (TypeError, ValueError):
+                    limit = offset = -1
+                
+                if not query or limit < 1 or offset < 0:
+                    return error_response(400, 'Укажите строку поиска')
+                
+                # Только свои переписки; с friend_id — одна переписка через idx_direct_messages_conversation
+                if friend_id is not None:
+                    scope = "LEAST(dm.sender_id, dm.recipient_id) = %s AND GREATEST(dm.sender_id, dm.recipient_id) = %s"
+                    scope_params = [min(user_id, friend_id), max(user_id, friend_id)]
+                else:
+                    scope = "(dm.sender_id = %s OR dm.recipient_id = %s)"
+                    scope_params = [user_id, user_id]
+                
+                # snippet — HTML: текст экранируется до подсветки, разметкой остаются только <mark>
+                conn = get_connection()
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                cursor.execute(
+                    f"""WITH q AS (
+                           SELECT websearch_to_tsquery('russian', %s) || websearch_to_tsquery('english', %s) AS query
+                       )
+                       SELECT page.id, page.sender_id, page.recipient_id, page.content, page.created_at, page.rank,
+                              ts_headline('russian', replace(replace(replace(replace(replace(
+                                  page.content, '&', '&amp;'), '<', '&lt;'), '>', '&gt;'), '"', '&quot;'), '''', '&#39;'),
+                                  q.query, %s) AS snippet
+                       FROM (
+                           SELECT dm.id, dm.sender_id, dm.recipient_id, dm.content, dm.created_at,
+                                  ts_rank(dm.search_vector, q.query) AS rank
+                           FROM direct_messages dm, q
+                           WHERE dm.search_vector @@ q.query AND {scope}
+                           ORDER BY rank DESC, dm.id DESC
+                           LIMIT %s OFFSET %s
+                       ) page, q
+                       ORDER BY page.rank DESC, page.id DESC""",
+                    [query, query, HEADLINE_OPTIONS, *scope_params, limit + 1, offset]
+                )
+                results = cursor.fetchall()
+                has_more = len(results) > limit
+                
+                return json_response(200, {'results': results[:limit], 'has_more': has_more})
+            
+            elif action == 'export':
+                try:
+                    friend_id = int(body.get('friend_id'))
+                except (TypeError, ValueError):
+                    return error_response(400, 'Укажите friend_id')
+                
+                # Части пишутся на диск по мере чтения курсора; забираются через GET ?export_id=&chunk=
+                conn = get_connection()
+                manifest = export_conversation(conn, user_id, friend_id)
+                
+                return json_response(200, {
+                    'success': True,
+                    'export_id': manifest['export_id'],
+                    'rows': manifest['rows'],
+                    'chunks': manifest['chunks']
+                })
         
         elif method == 'GET':
             params = event.get('queryStringParameters', {})
-            user_id = params.get('user_id')
-            friend_id = params.get('friend_id')
             
-            if not user_id or not friend_id:
+            if params.get('export_id'):
+                try:
+                    chunk = read_chunk(user_id, params['export_id'], int(params.get('chunk') or 0))
+                except ValueError:
+                    chunk = None
+                
+                if chunk is None:
+                    return error_response(404, 'Часть выгрузки не найдена')
+                
                 return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Укажите user_id и friend_id'}),
-                    'isBase64Encoded': False
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/x-ndjson',
+                        'Content-Encoding': 'gzip',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': base64.b64encode(chunk).decode('ascii'),
+                    'isBase64Encoded': True
                 }
             
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(
-                """SELECT dm.*, 
-                          u.username, u.discriminator, u.avatar,
-                          (SELECT json_agg(json_build_object('emoji', emoji, 'count', count, 'users', users))
-                           FROM (
-                               SELECT emoji, COUNT(*) as count, array_agg(user_id::text) as users
-                               FROM message_reactions 
-                               WHERE message_id = dm.id AND message_type = 'direct'
-                               GROUP BY emoji
-                           ) reactions) as reactions
-                   FROM direct_messages dm
-                   JOIN users u ON u.id = dm.sender_id
-                   WHERE (dm.sender_id = %s AND dm.recipient_id = %s) 
-                      OR (dm.sender_id = %s AND dm.recipient_id = %s)
-                   ORDER BY dm.created_at ASC""",
-                (user_id, friend_id, friend_id, user_id)
-            )
-            messages = cursor.fetchall()
-            
-            cursor.execute(
-                "UPDATE direct_messages SET read = TRUE WHERE sender_id = %s AND recipient_id = %s AND read = FALSE",
-                (friend_id, user_id)
-            )
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'messages': [
-                        {
-                            **dict(msg),
-                            'created_at': msg['created_at'].isoformat() if msg['created_at'] else None,
-                            'reactions': msg['reactions'] or []
-                        }
-                        for msg in messages
-                    ]
-                }, default=str),
-                'isBase64Encoded': False
-            }
+            friend_id = params.get('friend_id')
+            
+            if not friend_id:
+                return error_response(400, 'Укажите friend_id')
+            
+            if params.get('ids'):
+                # Опрос уже загруженных сообщений: реакции и прочтение меняются без новых строк
+                try:
+                    friend_id = int(friend_id)
+                    message_ids = [int(message_id) for message_id in params['ids'].split(',')]
+                except ValueError:
+                    return error_response(400, 'Неверный список ids')
+                
+                if len(message_ids) > MAX_BATCH_SIZE:
+                    return error_response(400, f'Не больше {MAX_BATCH_SIZE} сообщений за запрос')
+                
+                conn = get_connection()
+                cursor = conn.cursor()
+                cursor.execute(
+                    """SELECT dm.id, dm.reaction_count, dm.id <= COALESCE(cr.last_read_message_id, 0) AS read
+                       FROM (
+                           SELECT id, sender_id, recipient_id, reaction_count FROM direct_messages
+                           WHERE id = ANY(%s) AND LEAST(sender_id, recipient_id) = %s
+                             AND GREATEST(sender_id, recipient_id) = %s
+                           UNION ALL
+                           SELECT id, sender_id, recipient_id, reaction_count FROM direct_messages_archive
+                           WHERE id = ANY(%s) AND LEAST(sender_id, recipient_id) = %s
+                             AND GREATEST(sender_id, recipient_id) = %s
+                       ) dm
+                       LEFT JOIN conversation_reads cr ON cr.user_id = dm.recipient_id AND cr.peer_id = dm.sender_id
+                       ORDER BY dm.id""",
+                    [message_ids, min(user_id, friend_id), max(user_id, friend_id)] * 2
+                )
+                messages = rows_to_dicts(('id', 'reaction_count', 'read'), cursor.fetchall())
+                reactions = load_reactions(conn, [msg['id'] for msg in messages if msg['reaction_count']])
+                for msg in messages:
+                    msg['reactions'] = reactions.get(msg['id'], [])
+                
+                return json_response(200, {'messages': messages})
+            
+            try:
+                friend_id = int(friend_id)
+                before_id = int(params['before_id']) if params.get('before_id') else None
+                after_id = int(params['after_id']) if params.get('after_id') else None
+                limit = min(int(params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+            except ValueError:
+                return error_response(400, 'Неверные параметры пагинации')
+            
+            if limit < 1 or (before_id is not None and after_id is not None):
+                return error_response(400, 'Неверные параметры пагинации')
+            
+            # Страница читается обычным курсором в кортежи — без RealDictRow на каждую строку
+            sql, query_params, order = history_query(user_id, friend_id, before_id, after_id, limit)
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.execute(sql, query_params)
+            rows = cursor.fetchall()
+            has_more = len(rows) > limit
+            messages = rows_to_dicts(HISTORY_COLUMNS, rows[:limit])
+            if order == "DESC":
+                messages.reverse()
+            
+            # Реакции всей страницы одним запросом — только для сообщений, у которых они есть
+            reactions = load_reactions(conn, [msg['id'] for msg in messages if msg['reaction_count']])
+            
+            # Отметка о прочтении — одна запись high-water mark и только если она сдвигается вперёд
+            last_read_id = max((msg['id'] for msg in messages if msg['sender_id'] == friend_id), default=None)
+            if last_read_id is not None:
+                cursor.execute(
+                    """WITH advanced AS (
+                           INSERT INTO conversation_reads (user_id, peer_id, last_read_message_id)
+                           VALUES (%s, %s, %s)
+                           ON CONFLICT (user_id, peer_id) DO UPDATE
+                           SET last_read_message_id = EXCLUDED.last_read_message_id
+                           WHERE conversation_reads.last_read_message_id < EXCLUDED.last_read_message_id
+                           RETURNING last_read_message_id
+                       ), recount AS (
+                           -- Непрочитанное могло уйти в архив — считаем обе таблицы по индексам переписки
+                           UPDATE unread_counters SET count = (
+                               SELECT COUNT(*) FROM direct_messages
+                               WHERE LEAST(sender_id, recipient_id) = %s AND GREATEST(sender_id, recipient_id) = %s
+                                 AND id > a.last_read_message_id AND sender_id = %s
+                           ) + (
+                               SELECT COUNT(*) FROM direct_messages_archive
+                               WHERE LEAST(sender_id, recipient_id) = %s AND GREATEST(sender_id, recipient_id) = %s
+                                 AND id > a.last_read_message_id AND sender_id = %s
+                           )
+                           FROM advanced a
+                           WHERE unread_counters.user_id = %s AND unread_counters.peer_id = %s
+                       )
+                       SELECT pg_notify(%s, json_build_object(
+                           'type', 'read', 'user_id', %s, 'peer_id', %s,
+                           'last_read_message_id', last_read_message_id,
+                           'recipients', json_build_array(%s)
+                       )::text)
+                       FROM advanced""",
+                    (user_id, friend_id, last_read_id,
+                     min(user_id, friend_id), max(user_id, friend_id), friend_id,
+                     min(user_id, friend_id), max(user_id, friend_id), friend_id,
+                     user_id, friend_id,
+                     EVENTS_CHANNEL, user_id, friend_id, friend_id)
+                )
+            
+            for msg in messages:
+                msg['reactions'] = reactions.get(msg['id'], [])
+            
+            return json_response(200, {'messages': messages, 'has_more': has_more})
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
+        return error_response(405, 'Метод не поддерживается')
     
     finally:
-        conn.close()
+        if conn is not None:
+            release_connection(conn)
@@ -0,0 +1,100 @@
+"""
+Business: Сессии пользователей — выпуск, отзыв и проверка токенов с кэшем в памяти
+Args: SESSION_TTL_DAYS, SESSION_CACHE_TTL_SECONDS, SESSION_CACHE_SIZE из окружения
+Returns: create_session / revoke_session / authenticate для обработчиков
+"""
+
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from db import get_connection, release_connection
+from typing import Any, Dict, Optional, Tuple
+
+SESSION_TTL_DAYS = int(os.environ.get('SESSION_TTL_DAYS', '30'))
+CACHE_TTL_SECONDS = float(os.environ.get('SESSION_CACHE_TTL_SECONDS', '60'))
+CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '10000'))
+
+# token_hash -> (user_id, момент по time.monotonic(), до которого запись действительна)
+_cache: 'OrderedDict[str, Tuple[int, float]]' = OrderedDict()
+_lock = threading.Lock()
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def get_token(event: Dict[str, Any]) -> Optional[str]:
+    headers = event.get('headers') or {}
+    for name, value in headers.items():
+        if name.lower() == 'x-auth-token' and value:
+            return value
+    return None
+
+def _cache_get(token_hash: str) -> Optional[int]:
+    with _lock:
+        entry = _cache.get(token_hash)
+        if entry is None:
+            return None
+        user_id, valid_until = entry
+        if time.monotonic() >= valid_until:
+            del _cache[token_hash]
+            return None
+        _cache.move_to_end(token_hash)
+        return user_id
+
+def _cache_put(token_hash: str, user_id: int, expires_at: datetime) -> None:
+    seconds_left = (expires_at - datetime.utcnow()).total_seconds()
+    valid_until = time.monotonic() + min(CACHE_TTL_SECONDS, seconds_left)
+    with _lock:
+        _cache[token_hash] = (user_id, valid_until)
+        _cache.move_to_end(token_hash)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def create_session(conn, user_id: int) -> str:
+    token = secrets.token_urlsafe(32)
+    token_hash = hash_token(token)
+    expires_at = datetime.utcnow() + timedelta(days=SESSION_TTL_DAYS)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO sessions (token_hash, user_id, expires_at) VALUES (%s, %s, %s)",
+        (token_hash, user_id, expires_at)
+    )
+    _cache_put(token_hash, user_id, expires_at)
+    return token
+
+def revoke_session(conn, token: str) -> None:
+    token_hash = hash_token(token)
+    with _lock:
+        _cache.pop(token_hash, None)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM sessions WHERE token_hash = %s", (token_hash,))
+
+def authenticate(event: Dict[str, Any]) -> Optional[int]:
+    token = get_token(event)
+    if not token:
+        return None
+
+    token_hash = hash_token(token)
+    user_id = _cache_get(token_hash)
+    if user_id is not None:
+        return user_id
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT user_id, expires_at FROM sessions WHERE token_hash = %s AND expires_at > (now() AT TIME ZONE 'utc')",
+            (token_hash,)
+        )
+        row = cursor.fetchone()
+    finally:
+        release_connection(conn)
+
+    if not row:
+        return None
+    user_id, expires_at = row
+    _cache_put(token_hash, user_id, expires_at)
+    return user_id
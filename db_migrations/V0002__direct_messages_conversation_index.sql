@@ -0,0 +1,10 @@
+-- Индексы для выборки переписки по паре пользователей
+
+-- Пара (меньший id, больший id) + id: страница переписки читается из индекса без сортировки
+CREATE INDEX IF NOT EXISTS idx_direct_messages_conversation
+    ON direct_messages (LEAST(sender_id, recipient_id), GREATEST(sender_id, recipient_id), id);
+
+-- Непрочитанные сообщения получателя от конкретного отправителя
+CREATE INDEX IF NOT EXISTS idx_direct_messages_unread
+    ON direct_messages (recipient_id, sender_id)
+    WHERE read = FALSE;
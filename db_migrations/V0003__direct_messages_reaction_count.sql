@@ -0,0 +1,13 @@
+-- Счётчик реакций на личных сообщениях: страница без реакций не обращается к message_reactions
+
+ALTER TABLE direct_messages ADD COLUMN IF NOT EXISTS reaction_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE direct_messages dm
+SET reaction_count = r.count
+FROM (
+    SELECT message_id, COUNT(*) AS count
+    FROM message_reactions
+    WHERE message_type = 'direct'
+    GROUP BY message_id
+) r
+WHERE r.message_id = dm.id;
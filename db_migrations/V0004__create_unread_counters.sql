@@ -0,0 +1,15 @@
+-- Счётчики непрочитанных личных сообщений: user_id получил count сообщений от peer_id
+
+CREATE TABLE IF NOT EXISTS unread_counters (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    peer_id INTEGER NOT NULL REFERENCES users(id),
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, peer_id)
+);
+
+INSERT INTO unread_counters (user_id, peer_id, count)
+SELECT recipient_id, sender_id, COUNT(*)
+FROM direct_messages
+WHERE read = FALSE
+GROUP BY recipient_id, sender_id
+ON CONFLICT (user_id, peer_id) DO UPDATE SET count = EXCLUDED.count;
@@ -0,0 +1,6 @@
+-- Полнотекстовый поиск по личным сообщениям (русская и английская морфология)
+
+ALTER TABLE direct_messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('russian', content) || to_tsvector('english', content)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_direct_messages_search ON direct_messages USING GIN (search_vector);
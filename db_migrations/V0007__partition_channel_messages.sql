@@ -0,0 +1,41 @@
+-- Сообщения каналов: секционирование по хэшу channel_id
+-- История канала читается из одной секции по первичному ключу (channel_id, id) в обратном порядке
+
+ALTER TABLE channel_messages RENAME TO channel_messages_legacy;
+DROP INDEX IF EXISTS idx_channel_messages_channel;
+
+CREATE TABLE channel_messages (
+    id BIGSERIAL,
+    channel_id INTEGER NOT NULL REFERENCES channels(id),
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    content TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('russian', content) || to_tsvector('english', content)) STORED,
+    PRIMARY KEY (channel_id, id)
+) PARTITION BY HASH (channel_id);
+
+DO $$
+BEGIN
+    FOR i IN 0..15 LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS channel_messages_p%s PARTITION OF channel_messages FOR VALUES WITH (MODULUS 16, REMAINDER %s)',
+            i, i
+        );
+    END LOOP;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_channel_messages_search ON channel_messages USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_channel_messages_created_at ON channel_messages (created_at);
+
+INSERT INTO channel_messages (id, channel_id, user_id, content, created_at)
+SELECT id, channel_id, user_id, content, created_at FROM channel_messages_legacy;
+
+SELECT setval(pg_get_serial_sequence('channel_messages', 'id'), COALESCE(MAX(id), 0) + 1, false)
+FROM channel_messages;
+
+DROP TABLE channel_messages_legacy;
+
+-- Участники серверов и каналы сервера
+CREATE INDEX IF NOT EXISTS idx_server_members_user_id ON server_members(user_id);
+CREATE INDEX IF NOT EXISTS idx_channels_server_id ON channels(server_id);
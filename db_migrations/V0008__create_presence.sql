@@ -0,0 +1,12 @@
+-- Присутствие пользователей: heartbeat продлевает expires_at, истёкшие записи удаляются пачками
+-- UNLOGGED: данные эфемерны, после сбоя сервера все просто считаются offline
+
+CREATE UNLOGGED TABLE IF NOT EXISTS presence (
+    user_id INTEGER PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'online',
+    last_heartbeat TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    last_seen_flushed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_presence_expires_at ON presence(expires_at);
@@ -0,0 +1,18 @@
+-- Прочитанность личных сообщений: одна отметка (high-water mark) на пару вместо флага в каждой строке
+
+CREATE TABLE IF NOT EXISTS conversation_reads (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    peer_id INTEGER NOT NULL REFERENCES users(id),
+    last_read_message_id INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, peer_id)
+);
+
+INSERT INTO conversation_reads (user_id, peer_id, last_read_message_id)
+SELECT recipient_id, sender_id, MAX(id)
+FROM direct_messages
+WHERE read = TRUE
+GROUP BY recipient_id, sender_id
+ON CONFLICT (user_id, peer_id) DO UPDATE SET last_read_message_id = EXCLUDED.last_read_message_id;
+
+DROP INDEX IF EXISTS idx_direct_messages_unread;
+ALTER TABLE direct_messages DROP COLUMN IF EXISTS read;
@@ -0,0 +1,61 @@
+-- Заявки в друзья и «возможно, вы знакомы»
+-- friendships: 'pending' — строка от отправителя к получателю, 'accepted' — по строке в каждую сторону,
+-- 'blocked' — строка от заблокировавшего
+
+-- Оба шага обхода графа друзей читаются только из индекса
+CREATE INDEX IF NOT EXISTS idx_friendships_accepted ON friendships (user_id, friend_id) WHERE status = 'accepted';
+CREATE INDEX IF NOT EXISTS idx_friendships_incoming ON friendships (friend_id) WHERE status = 'pending';
+
+-- Готовые рекомендации: top-K друзей друзей по числу общих друзей
+CREATE TABLE IF NOT EXISTS friend_suggestions (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    candidate_id INTEGER NOT NULL REFERENCES users(id),
+    mutual_count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, candidate_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_friend_suggestions_rank ON friend_suggestions (user_id, mutual_count DESC, candidate_id);
+
+-- Пользователи, чьи рекомендации устарели после изменений в графе
+CREATE TABLE IF NOT EXISTS friend_suggestions_dirty (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    marked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION refresh_friend_suggestions(target_ids INTEGER[], top_k INTEGER DEFAULT 50)
+RETURNS INTEGER AS $$
+DECLARE
+    started TIMESTAMP := clock_timestamp();
+    inserted INTEGER;
+BEGIN
+    DELETE FROM friend_suggestions WHERE user_id = ANY(target_ids);
+
+    INSERT INTO friend_suggestions (user_id, candidate_id, mutual_count)
+    SELECT user_id, candidate_id, mutual_count
+    FROM (
+        SELECT f1.user_id, f2.friend_id AS candidate_id, COUNT(*) AS mutual_count,
+               ROW_NUMBER() OVER (PARTITION BY f1.user_id ORDER BY COUNT(*) DESC, f2.friend_id) AS position
+        FROM friendships f1
+        JOIN friendships f2 ON f2.user_id = f1.friend_id AND f2.status = 'accepted'
+        WHERE f1.user_id = ANY(target_ids) AND f1.status = 'accepted'
+          AND f2.friend_id <> f1.user_id
+          -- Любая связь в любую сторону (дружба, заявка, блокировка) исключает кандидата
+          AND NOT EXISTS (
+              SELECT 1 FROM friendships x
+              WHERE (x.user_id, x.friend_id) IN ((f1.user_id, f2.friend_id), (f2.friend_id, f1.user_id))
+          )
+        GROUP BY f1.user_id, f2.friend_id
+    ) ranked
+    WHERE position <= top_k;
+    GET DIAGNOSTICS inserted = ROW_COUNT;
+
+    -- Пометки, появившиеся во время пересчёта, остаются до следующего прохода
+    DELETE FROM friend_suggestions_dirty WHERE user_id = ANY(target_ids) AND marked_at <= started;
+    RETURN inserted;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Первичное заполнение делает воркер: помечаем всех, у кого есть друзья
+INSERT INTO friend_suggestions_dirty (user_id)
+SELECT DISTINCT user_id FROM friendships WHERE status = 'accepted'
+ON CONFLICT (user_id) DO NOTHING;
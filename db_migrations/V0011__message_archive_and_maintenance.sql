@@ -0,0 +1,35 @@
+-- Архив личных сообщений и служебные таблицы воркера обслуживания (worker/retention.py)
+
+-- Старые сообщения переезжают сюда пачками; история читается из обеих таблиц по индексу переписки.
+-- Без search_vector и GIN-индекса, текст сжимается lz4 уже со 128 байт
+CREATE TABLE IF NOT EXISTS direct_messages_archive (
+    id INTEGER PRIMARY KEY,
+    sender_id INTEGER NOT NULL REFERENCES users(id),
+    recipient_id INTEGER NOT NULL REFERENCES users(id),
+    content TEXT NOT NULL,
+    created_at TIMESTAMP,
+    reaction_count INTEGER NOT NULL DEFAULT 0,
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) WITH (toast_tuple_target = 128);
+
+-- lz4 есть только в сборках Postgres с --with-lz4; без него остаётся pglz по умолчанию
+DO $$
+BEGIN
+    ALTER TABLE direct_messages_archive ALTER COLUMN content SET COMPRESSION lz4;
+EXCEPTION WHEN feature_not_supported THEN
+    RAISE NOTICE 'lz4 недоступен, архив сжимается pglz';
+END;
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_direct_messages_archive_conversation
+    ON direct_messages_archive (LEAST(sender_id, recipient_id), GREATEST(sender_id, recipient_id), id);
+
+-- Проверка «висячих» реакций на сообщения каналов ищет сообщение по одному id
+CREATE INDEX IF NOT EXISTS idx_channel_messages_id ON channel_messages (id);
+
+-- Позиции проходов воркера, чтобы продолжать с места остановки
+CREATE TABLE IF NOT EXISTS maintenance_progress (
+    job VARCHAR(50) PRIMARY KEY,
+    position BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,221 @@
+"""
+Business: Шлюз событий реального времени (SSE) поверх Postgres LISTEN/NOTIFY
+Args: DATABASE_URL, GATEWAY_HOST, GATEWAY_PORT из окружения;
+      клиент подключается к GET /events?token=<токен сессии>
+Returns: долгоживущий процесс, рассылающий события канала dm_events получателям
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import psycopg2
+import psycopg2.extensions
+from typing import Dict, Any, Optional, Set
+from urllib.parse import urlsplit, parse_qs
+
+EVENTS_CHANNEL = 'dm_events'
+KEEPALIVE_SECONDS = 15
+RECONNECT_SECONDS = 2
+QUEUE_SIZE = 100
+
+RESYNC_EVENT = {'type': 'resync'}
+
+class Gateway:
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self.listen_conn = None
+        self.lookup_conn = None
+        self.lookup_lock = threading.Lock()
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        queues = self.subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[user_id]
+
+    def _push(self, queue: asyncio.Queue, event: Dict[str, Any]) -> None:
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Медленный клиент: отбрасываем очередь, он перечитает историю сам
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC_EVENT)
+
+    def dispatch(self, payload: str) -> None:
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        recipients = event.pop('recipients', [])
+        for user_id in set(recipients):
+            for queue in self.subscribers.get(user_id, ()):
+                self._push(queue, event)
+
+    def broadcast_resync(self) -> None:
+        for queues in self.subscribers.values():
+            for queue in queues:
+                self._push(queue, RESYNC_EVENT)
+
+    async def listen(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                conn = await loop.run_in_executor(None, self._connect)
+            except psycopg2.Error:
+                await asyncio.sleep(RECONNECT_SECONDS)
+                continue
+
+            self.listen_conn = conn
+            lost = loop.create_future()
+            loop.add_reader(conn.fileno(), self._on_readable, conn, lost)
+            # События, пришедшие пока соединения не было, потеряны
+            self.broadcast_resync()
+            try:
+                await lost
+            finally:
+                loop.remove_reader(conn.fileno())
+                conn.close()
+                self.listen_conn = None
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        conn.cursor().execute(f"LISTEN {EVENTS_CHANNEL}")
+        return conn
+
+    def _lookup_session(self, token: str) -> Optional[int]:
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        with self.lookup_lock:
+            if self.lookup_conn is None or self.lookup_conn.closed:
+                self.lookup_conn = psycopg2.connect(self.dsn)
+                self.lookup_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            try:
+                cursor = self.lookup_conn.cursor()
+                cursor.execute(
+                    "SELECT user_id FROM sessions WHERE token_hash = %s AND expires_at > (now() AT TIME ZONE 'utc')",
+                    (token_hash,)
+                )
+                row = cursor.fetchone()
+            except psycopg2.Error:
+                self.lookup_conn.close()
+                raise
+        return row[0] if row else None
+
+    async def authenticate(self, token: str) -> Optional[int]:
+        if not token:
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(None, self._lookup_session, token)
+        except psycopg2.Error:
+            return None
+
+    def _on_readable(self, conn, lost: asyncio.Future) -> None:
+        try:
+            conn.poll()
+        except psycopg2.Error:
+            if not lost.done():
+                lost.set_result(None)
+            return
+        while conn.notifies:
+            self.dispatch(conn.notifies.pop(0).payload)
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] not in ('GET', 'OPTIONS'):
+                await self._write_status(writer, 405, 'Method Not Allowed')
+                return
+
+            url = urlsplit(parts[1])
+            if url.path != '/events':
+                await self._write_status(writer, 404, 'Not Found')
+                return
+
+            if parts[0] == 'OPTIONS':
+                await self._write_status(writer, 200, 'OK')
+                return
+
+            user_id = await self.authenticate(parse_qs(url.query).get('token', [''])[0])
+            if user_id is None:
+                await self._write_status(writer, 401, 'Unauthorized')
+                return
+
+            await self.stream(user_id, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def stream(self, user_id: int, writer: asyncio.StreamWriter) -> None:
+        writer.write(
+            b'HTTP/1.1 200 OK\r\n'
+            b'Content-Type: text/event-stream\r\n'
+            b'Cache-Control: no-cache\r\n'
+            b'Connection: keep-alive\r\n'
+            b'Access-Control-Allow-Origin: *\r\n'
+            b'\r\n'
+            b'retry: 3000\n\n'
+        )
+        await writer.drain()
+
+        queue = self.subscribe(user_id)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    writer.write(b': keepalive\n\n')
+                else:
+                    writer.write(format_event(event))
+                await writer.drain()
+        finally:
+            self.unsubscribe(user_id, queue)
+
+    async def _write_status(self, writer: asyncio.StreamWriter, status: int, reason: str) -> None:
+        writer.write(
+            f'HTTP/1.1 {status} {reason}\r\n'
+            'Access-Control-Allow-Origin: *\r\n'
+            'Access-Control-Allow-Methods: GET, OPTIONS\r\n'
+            'Content-Length: 0\r\n'
+            '\r\n'.encode()
+        )
+        await writer.drain()
+
+    async def serve(self, host: str, port: int) -> None:
+        listener = asyncio.create_task(self.listen())
+        server = await asyncio.start_server(self.handle_client, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            listener.cancel()
+
+def format_event(event: Dict[str, Any]) -> bytes:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode()
+
+def main(host: Optional[str] = None, port: Optional[int] = None) -> None:
+    gateway = Gateway(os.environ['DATABASE_URL'])
+    asyncio.run(gateway.serve(
+        host or os.environ.get('GATEWAY_HOST', '0.0.0.0'),
+        port or int(os.environ.get('GATEWAY_PORT', '8080'))
+    ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3 @@
+"""
+Локальный стенд: вызывает обработчики backend/ в одном процессе против одноразовой базы Postgres
+"""
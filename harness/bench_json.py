@@ -0,0 +1,96 @@
+"""
+Микробенчмарк сериализации истории: прежний путь (RealDict-строки, копии с isoformat, json.dumps)
+против response.py (кортежи -> rows_to_dicts -> dumps). База не нужна.
+
+python -m harness.bench_json [--rows 5000] [--repeat 50]
+"""
+
+import argparse
+import importlib.util
+import json
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+
+COLUMNS = ('id', 'sender_id', 'recipient_id', 'content', 'created_at', 'reaction_count', 'read',
+           'username', 'discriminator', 'avatar')
+
+def load_response_module(use_orjson: bool):
+    spec = importlib.util.spec_from_file_location('response', BACKEND_DIR / 'messages' / 'response.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if not use_orjson and module.orjson is not None:
+        # Повторно исполняем модуль без orjson, чтобы замерить запасной путь на stdlib
+        saved = sys.modules.get('orjson')
+        sys.modules['orjson'] = None
+        try:
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        finally:
+            if saved is not None:
+                sys.modules['orjson'] = saved
+            else:
+                sys.modules.pop('orjson', None)
+    return module
+
+def make_rows(count: int):
+    started = datetime(2024, 1, 1, 12, 0, 0)
+    return [
+        (i, 1 + i % 2, 2 - i % 2, f'Сообщение номер {i}: привет, как дела? Заходи вечером в голосовой канал',
+         started + timedelta(seconds=i, microseconds=i), 0, i % 3 == 0, 'Игрок', '0001', '👤')
+        for i in range(1, count + 1)
+    ]
+
+def legacy(rows) -> str:
+    # RealDictCursor отдаёт OrderedDict-подкласс на строку, дальше копия с isoformat
+    messages = [OrderedDict(zip(COLUMNS, row)) for row in rows]
+    return json.dumps({
+        'messages': [
+            {
+                **dict(msg),
+                'created_at': msg['created_at'].isoformat() if msg['created_at'] else None,
+                'reactions': []
+            }
+            for msg in messages
+        ],
+        'has_more': False
+    }, default=str)
+
+def current(response, rows) -> str:
+    messages = response.rows_to_dicts(COLUMNS, rows)
+    for msg in messages:
+        msg['reactions'] = []
+    return response.json_response(200, {'messages': messages, 'has_more': False})['body']
+
+def measure(fn, repeat: int) -> float:
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Сериализация истории сообщений')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    results = [('json.dumps + RealDict + isoformat', measure(lambda: legacy(rows), args.repeat))]
+    stdlib = load_response_module(use_orjson=False)
+    results.append(('response.py (stdlib)', measure(lambda: current(stdlib, rows), args.repeat)))
+    fast = load_response_module(use_orjson=True)
+    if fast.orjson is not None:
+        results.append(('response.py (orjson)', measure(lambda: current(fast, rows), args.repeat)))
+
+    baseline = results[0][1]
+    print(f"{args.rows} сообщений, {args.repeat} повторов")
+    for label, seconds in results:
+        print(f"{label:<36} {seconds * 1000:8.2f} мс  {1 / seconds:8.1f} ответов/с  x{baseline / seconds:.2f}")
+
+if __name__ == '__main__':
+    main()
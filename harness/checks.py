@@ -0,0 +1,230 @@
+"""
+Проверки на засеянной базе: планы горячих запросов и доставка событий через шлюз; каждая падает с AssertionError
+"""
+
+import asyncio
+import importlib.util
+import json
+import socket
+from typing import Any, Callable, Dict, Iterator, List
+
+from harness.functions import ROOT
+from harness.profiles import Context
+
+GATEWAY_TIMEOUT_SECONDS = 5
+
+def walk(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk(child)
+
+def explain(ctx: Context, sql: str, params: List[Any]) -> Dict[str, Any]:
+    conn = ctx.db.connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+        return (json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']
+    finally:
+        conn.close()
+
+def history_plan(ctx: Context, pairs: int = 200, rows: int = 50000) -> None:
+    # Переписки многих пар в обеих таблицах: страница одной пары должна читаться индексом без сортировки.
+    # Как после воркера, в архиве младшие id (1..rows), в горячей таблице — старшие (rows+1..2*rows)
+    users = [user_id for user_id, _ in ctx.seed_users(pairs * 2, 'plan')]
+    conn = ctx.db.connect()
+    try:
+        cursor = conn.cursor()
+        for table in ('direct_messages_archive', 'direct_messages'):
+            cursor.execute(
+                f"""INSERT INTO {table} (id, sender_id, recipient_id, content, created_at)
+                    SELECT nextval(pg_get_serial_sequence('direct_messages', 'id')),
+                           (%s::int[])[1 + (n %% %s) * 2], (%s::int[])[2 + (n %% %s) * 2],
+                           'сообщение ' || n, LOCALTIMESTAMP
+                    FROM generate_series(1, %s) n""",
+                (users, pairs, users, pairs, rows)
+            )
+            cursor.execute(f"ANALYZE {table}")
+    finally:
+        conn.close()
+
+    messages = ctx.functions['messages'].index
+    a, b = users[0], users[1]
+    hot = ('direct_messages', 'idx_direct_messages_conversation')
+    archive = ('direct_messages_archive', 'idx_direct_messages_archive_conversation')
+    # Ветка, у которой за курсором по статистике пусто, может взять короткий диапазон первичного ключа —
+    # это дёшево и не проверяется: before_id в архиве ничего не найдёт в горячей таблице, и наоборот
+    pages = {
+        'первая страница': (messages.history_query(a, b, None, None, 50), (hot, archive)),
+        'before_id в горячей таблице': (messages.history_query(a, b, rows + rows // 2, None, 50), (hot, archive)),
+        'before_id в архиве': (messages.history_query(a, b, rows // 2, None, 50), (archive,)),
+        'after_id в горячей таблице': (messages.history_query(a, b, None, rows + rows // 2, 50), (hot,)),
+        'after_id в архиве': (messages.history_query(a, b, None, rows // 2, 50), (hot, archive)),
+    }
+
+    for name, ((sql, params, _), expected) in pages.items():
+        plan = explain(ctx, sql, params)
+        # LIMIT ветки UNION ALL — тот, под которым читается ровно одна из таблиц
+        branches = {}
+        for node in walk(plan):
+            if node['Node Type'] != 'Limit':
+                continue
+            relations = {n.get('Relation Name') for n in walk(node)} & {hot[0], archive[0]}
+            if len(relations) == 1:
+                branches[relations.pop()] = node
+        for table, index in expected:
+            assert table in branches, f"{name}: нет отдельного LIMIT для {table}\n{json.dumps(plan, indent=2)}"
+            nodes = list(walk(branches[table]))
+            assert any(n['Node Type'] in ('Index Scan', 'Index Only Scan') and n.get('Index Name') == index
+                       for n in nodes), f"{name}: {table} читается не через {index}\n{json.dumps(plan, indent=2)}"
+            assert not any(n['Node Type'] in ('Sort', 'Incremental Sort') for n in nodes), \
+                f"{name}: сортировка под LIMIT для {table}\n{json.dumps(plan, indent=2)}"
+
+def friend_requests(ctx: Context) -> None:
+    # Заявки и блокировка от лица обеих сторон — в tests.json у replay есть сессия только одного пользователя
+    (a, token_a), (b, token_b), (c, token_c) = ctx.seed_users(3, 'requests')
+    friends, messages = ctx.functions['friends'], ctx.functions['messages']
+
+    def call(function, token: str, body: Dict[str, Any], expected: int):
+        response = function.invoke('POST', body=body, token=token)
+        assert response.status == expected, f"{body}: ожидался {expected}, получено {response.status}: {response.body}"
+        return response
+
+    def friend_ids(token: str) -> List[int]:
+        return [friend['id'] for friend in friends.invoke('GET', token=token).body['friends']]
+
+    call(friends, token_a, {'action': 'add', 'friend_code': 'requests2#0001'}, 200)
+    incoming = friends.invoke('GET', '/?view=requests', token=token_b).body['incoming']
+    assert [r['id'] for r in incoming] == [a], f"входящая заявка не дошла: {incoming}"
+    call(friends, token_b, {'action': 'accept', 'friend_id': a}, 200)
+    assert friend_ids(token_a) == [b] and friend_ids(token_b) == [a], "accept не сделал дружбу взаимной"
+
+    call(friends, token_c, {'action': 'add', 'friend_code': 'requests1#0001'}, 200)
+    call(friends, token_a, {'action': 'decline', 'friend_id': c}, 200)
+    call(friends, token_a, {'action': 'decline', 'friend_id': c}, 404)
+    assert friends.invoke('GET', '/?view=requests', token=token_c).body['outgoing'] == [], "decline не снял заявку"
+
+    call(friends, token_b, {'action': 'block', 'friend_id': a}, 200)
+    assert friend_ids(token_a) == [] and friend_ids(token_b) == [], "block не удалил дружбу"
+    call(messages, token_a, {'action': 'send', 'recipient_id': b, 'content': 'после блокировки'}, 403)
+    call(messages, token_b, {'action': 'send', 'recipient_id': a, 'content': 'после блокировки'}, 403)
+    call(friends, token_a, {'action': 'add', 'friend_code': 'requests2#0001'}, 404)
+
+    call(friends, token_b, {'action': 'unblock', 'friend_id': a}, 200)
+    call(messages, token_a, {'action': 'send', 'recipient_id': b, 'content': 'после разблокировки'}, 200)
+    call(friends, token_a, {'action': 'block', 'friend_id': 2 ** 31 - 1}, 404)
+
+def channel_access(ctx: Context) -> None:
+    # Чужой канал существует, но закрыт, пока пользователь не вступит в сервер
+    (a, token_a), (b, token_b) = ctx.seed_users(2, 'channels')
+    channels = ctx.functions['channels']
+    created = channels.invoke('POST', body={'action': 'create_server', 'name': 'Проверка доступа'}, token=token_a)
+    assert created.status == 200, f"create_server вернул {created.status}: {created.body}"
+    server_id, channel_id = created.body['server']['id'], created.body['server']['channels'][0]['id']
+    post = {'action': 'post', 'channel_id': channel_id, 'content': 'только для участников'}
+    assert channels.invoke('POST', body=post, token=token_a).status == 200
+
+    for attempt in ('до вступления', 'после вступления'):
+        expected = 403 if attempt == 'до вступления' else 200
+        history = channels.invoke('GET', f'/?channel_id={channel_id}', token=token_b)
+        sent = channels.invoke('POST', body=post, token=token_b)
+        assert history.status == expected and sent.status == expected, \
+            f"{attempt}: история {history.status}, отправка {sent.status}, ожидался {expected}"
+        if expected == 403:
+            joined = channels.invoke('POST', body={'action': 'join', 'server_id': server_id}, token=token_b)
+            assert joined.status == 200, f"join вернул {joined.status}: {joined.body}"
+
+def load_gateway():
+    spec = importlib.util.spec_from_file_location('gateway_server', ROOT / 'gateway' / 'server.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+async def _until(condition: Callable[[], bool]) -> None:
+    while not condition():
+        await asyncio.sleep(0.01)
+
+async def _open_events(port: int, token: str):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET /events?token={token} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+    await writer.drain()
+    status = (await reader.readline()).decode()
+    while (await reader.readline()) not in (b'\r\n', b''):
+        pass
+    return status, reader, writer
+
+async def _read_event(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    # Кадр SSE — строки «event:» и «data:» до пустой строки; комментарии и retry пропускаем
+    event: Dict[str, Any] = {}
+    while True:
+        line = (await reader.readline()).decode()
+        if not line:
+            raise AssertionError('шлюз закрыл соединение до события')
+        if line.startswith('event: '):
+            event['event'] = line[len('event: '):].strip()
+        elif line.startswith('data: '):
+            event['data'] = json.loads(line[len('data: '):])
+        elif line == '\n' and 'data' in event:
+            return event
+
+async def _gateway_roundtrip(ctx: Context, gateway_module) -> None:
+    (a, token_a), (b, token_b) = ctx.seed_users(2, 'gateway')
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    # При остановке сервера отменяется задача клиента; asyncio 3.11 печатает эту отмену как ошибку колбэка
+    loop = asyncio.get_running_loop()
+    loop.set_exception_handler(lambda loop, context: None if isinstance(
+        context.get('exception'), asyncio.CancelledError) else loop.default_exception_handler(context))
+
+    gateway = gateway_module.Gateway(ctx.db.dsn)
+    server = asyncio.create_task(gateway.serve('127.0.0.1', port))
+    writer = None
+    try:
+        # До LISTEN событие потерялось бы, а resync при подключении пришёл бы вперёд сообщения
+        await asyncio.wait_for(_until(lambda: gateway.listen_conn is not None), GATEWAY_TIMEOUT_SECONDS)
+
+        status, _, rejected = await _open_events(port, 'unknown-token')
+        rejected.close()
+        assert ' 401 ' in status, f"чужой токен: ожидался 401, получено {status.strip()!r}"
+
+        status, reader, writer = await _open_events(port, token_b)
+        assert ' 200 ' in status, f"ожидался 200, получено {status.strip()!r}"
+        await asyncio.wait_for(_until(lambda: b in gateway.subscribers), GATEWAY_TIMEOUT_SECONDS)
+
+        # Настоящая отправка: pg_notify выполняет обработчик messages в той же команде, что и INSERT
+        sent = await loop.run_in_executor(None, lambda: ctx.functions['messages'].invoke(
+            'POST', body={'action': 'send', 'recipient_id': b, 'content': 'через шлюз'}, token=token_a))
+        assert sent.status == 200, f"send вернул {sent.status}: {sent.body}"
+
+        try:
+            event = await asyncio.wait_for(_read_event(reader), GATEWAY_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise AssertionError(f"за {GATEWAY_TIMEOUT_SECONDS} с шлюз не прислал событие")
+        assert event.get('event') == 'message', f"ожидалось событие message, получено {event}"
+        data = event['data']
+        assert data.get('message_id') == sent.body['message']['id'] and data.get('sender_id') == a, \
+            f"событие не об отправленном сообщении: {data}"
+        assert 'recipients' not in data, f"список получателей ушёл клиенту: {data}"
+    finally:
+        if writer is not None:
+            writer.close()
+        server.cancel()
+        try:
+            await server
+        except asyncio.CancelledError:
+            pass
+        if gateway.lookup_conn is not None:
+            gateway.lookup_conn.close()
+
+def gateway_sse(ctx: Context) -> None:
+    # Шлюз в этом же процессе на свободном порту, клиент — сырой HTTP-запрос к /events
+    asyncio.run(_gateway_roundtrip(ctx, load_gateway()))
+
+CHECKS: Dict[str, Callable[[Context], None]] = {
+    'history_plan': history_plan,
+    'friend_requests': friend_requests,
+    'channel_access': channel_access,
+    'gateway_sse': gateway_sse,
+}
@@ -0,0 +1,129 @@
+"""
+Одноразовая база Postgres для локального прогона функций: создаётся, накатывает миграции, удаляется
+"""
+
+import os
+import re
+import secrets
+import shutil
+import socket
+import subprocess
+import tempfile
+import psycopg2
+from psycopg2.extensions import make_dsn
+from pathlib import Path
+from typing import List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+MIGRATIONS_DIR = ROOT / 'db_migrations'
+
+def migration_files() -> List[Path]:
+    # V0001__name.sql, V0002__name.sql ... в порядке версий
+    files = MIGRATIONS_DIR.glob('V*__*.sql')
+    return sorted(files, key=lambda p: int(re.match(r'V(\d+)__', p.name).group(1)))
+
+def _find_binary(name: str) -> Optional[str]:
+    path = shutil.which(name)
+    if path:
+        return path
+    pg_config = shutil.which('pg_config')
+    if pg_config:
+        bindir = subprocess.run([pg_config, '--bindir'], capture_output=True, text=True).stdout.strip()
+        candidate = Path(bindir) / name
+        if candidate.exists():
+            return str(candidate)
+    return None
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class DisposableDatabase:
+    """С admin_url создаёт отдельную базу на существующем сервере, иначе поднимает временный кластер через initdb."""
+
+    def __init__(self, admin_url: Optional[str] = None):
+        self.admin_url = admin_url
+        self.dsn: Optional[str] = None
+        self.dbname = f"harness_{secrets.token_hex(4)}"
+        self.cluster_dir: Optional[str] = None
+        self.data_dir: Optional[str] = None
+
+    def __enter__(self) -> 'DisposableDatabase':
+        if self.admin_url:
+            server_dsn = self.admin_url
+        else:
+            server_dsn = self._start_cluster()
+
+        admin = psycopg2.connect(server_dsn)
+        admin.autocommit = True
+        try:
+            # Миграции и данные на русском: кодировка базы не зависит от локали сервера
+            admin.cursor().execute(
+                f"CREATE DATABASE \"{self.dbname}\" ENCODING 'UTF8' LC_COLLATE 'C' LC_CTYPE 'C' TEMPLATE template0"
+            )
+        finally:
+            admin.close()
+
+        self.dsn = make_dsn(server_dsn, dbname=self.dbname)
+        self.migrate()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.admin_url:
+            admin = psycopg2.connect(self.admin_url)
+            admin.autocommit = True
+            try:
+                admin.cursor().execute(f'DROP DATABASE IF EXISTS "{self.dbname}" WITH (FORCE)')
+            finally:
+                admin.close()
+        if self.cluster_dir:
+            pg_ctl = _find_binary('pg_ctl')
+            subprocess.run([pg_ctl, '-D', self.data_dir, '-m', 'immediate', 'stop'], capture_output=True)
+            shutil.rmtree(self.cluster_dir, ignore_errors=True)
+
+    def _start_cluster(self) -> str:
+        initdb, pg_ctl = _find_binary('initdb'), _find_binary('pg_ctl')
+        if not initdb or not pg_ctl:
+            raise RuntimeError('Нужен HARNESS_DATABASE_URL или initdb/pg_ctl в PATH')
+
+        self.cluster_dir = tempfile.mkdtemp(prefix='harness-pg-')
+        self.data_dir = os.path.join(self.cluster_dir, 'data')
+        port = _free_port()
+        subprocess.run([initdb, '-D', self.data_dir, '-U', 'postgres', '-A', 'trust', '-E', 'UTF8'], check=True, capture_output=True)
+        subprocess.run(
+            [pg_ctl, '-D', self.data_dir, '-w', '-l', os.path.join(self.cluster_dir, 'postgres.log'),
+             '-o', f"-p {port} -k {self.cluster_dir} -c listen_addresses='' -c fsync=off", 'start'],
+            check=True, capture_output=True
+        )
+        return make_dsn(host=self.cluster_dir, port=port, user='postgres', dbname='postgres')
+
+    def connect(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        return conn
+
+    def migrate(self) -> None:
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            for path in migration_files():
+                cursor.execute(path.read_text(encoding='utf-8'))
+        finally:
+            conn.close()
+
+    def reset(self) -> None:
+        # Между профилями нагрузки очищаем все таблицы схемы public
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """SELECT c.relname FROM pg_class c
+                   JOIN pg_namespace n ON n.oid = c.relnamespace
+                   WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition"""
+            )
+            tables = [row[0] for row in cursor.fetchall()]
+            if tables:
+                cursor.execute(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY CASCADE")
+        finally:
+            conn.close()
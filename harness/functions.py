@@ -0,0 +1,171 @@
+"""
+Загрузка обработчиков backend/<функция>/index.py в один процесс и их вызов с подсчётом SQL-запросов
+"""
+
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+import psycopg2
+import psycopg2.extensions
+from dataclasses import dataclass
+from pathlib import Path
+from types import ModuleType, SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, parse_qsl
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / 'backend'
+# У каждой функции свои копии общих модулей с одинаковыми именами — грузим их изолированно
+FUNCTION_MODULES = ('index', 'db', 'session', 'tracing', 'response')
+
+_counter = threading.local()
+_cursor_classes: Dict[type, type] = {}
+_original_connect = psycopg2.connect
+
+def _counted(method):
+    def wrapper(self, *args, **kwargs):
+        _counter.queries = getattr(_counter, 'queries', 0) + 1
+        return method(self, *args, **kwargs)
+    return wrapper
+
+def _counting_cursor(factory: type) -> type:
+    if factory not in _cursor_classes:
+        _cursor_classes[factory] = type(
+            f"Counting{factory.__name__}",
+            (factory,),
+            {'execute': _counted(factory.execute), 'executemany': _counted(factory.executemany)}
+        )
+    return _cursor_classes[factory]
+
+class CountingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=_counting_cursor(factory), **kwargs)
+
+def _connect(*args, **kwargs):
+    factory = kwargs.get('connection_factory')
+    if factory is None:
+        kwargs['connection_factory'] = CountingConnection
+    elif not issubclass(factory, CountingConnection):
+        # При DB_TRACE пул передаёт TracingConnection — считаем поверх него
+        kwargs['connection_factory'] = type(f"Counting{factory.__name__}", (CountingConnection, factory), {})
+    return _original_connect(*args, **kwargs)
+
+def install_query_counter() -> None:
+    psycopg2.connect = _connect
+
+def reset_query_count() -> None:
+    _counter.queries = 0
+
+def query_count() -> int:
+    return getattr(_counter, 'queries', 0)
+
+@dataclass
+class Response:
+    status: int
+    body: Any
+    elapsed: float
+    queries: int
+
+class Function:
+    def __init__(self, name: str):
+        self.name = name
+        self.dir = BACKEND_DIR / name
+        self.modules = self._load()
+        self.index = self.modules['index']
+
+    def _load(self) -> Dict[str, ModuleType]:
+        saved = {name: sys.modules.pop(name) for name in FUNCTION_MODULES if name in sys.modules}
+        sys.path.insert(0, str(self.dir))
+        try:
+            importlib.import_module('index')
+            return {name: sys.modules[name] for name in FUNCTION_MODULES if name in sys.modules}
+        finally:
+            sys.path.remove(str(self.dir))
+            for name in FUNCTION_MODULES:
+                sys.modules.pop(name, None)
+            sys.modules.update(saved)
+
+    def disable_pool(self) -> None:
+        # Соединение на каждый вызов, как было до пула — для сравнения задержек
+        tracing = self.modules.get('tracing')
+        factory = tracing.connection_factory() if tracing else None
+
+        def get_connection():
+            conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=factory)
+            conn.autocommit = True
+            return conn
+
+        def release_connection(conn):
+            conn.close()
+
+        for module in self.modules.values():
+            if hasattr(module, 'get_connection'):
+                module.get_connection = get_connection
+                module.release_connection = release_connection
+
+    def tests(self) -> List[Dict[str, Any]]:
+        path = self.dir / 'tests.json'
+        if not path.exists():
+            return []
+        return json.loads(path.read_text(encoding='utf-8')).get('tests', [])
+
+    def invoke(self, method: str, path: str = '/', body: Optional[Dict[str, Any]] = None,
+               token: Optional[str] = None) -> Response:
+        url = urlsplit(path)
+        event = {
+            'httpMethod': method,
+            'path': url.path,
+            'headers': {'Content-Type': 'application/json', **({'X-Auth-Token': token} if token else {})},
+            'queryStringParameters': dict(parse_qsl(url.query)),
+            'body': json.dumps(body) if body is not None else '',
+            'isBase64Encoded': False
+        }
+        context = SimpleNamespace(request_id=str(uuid.uuid4()), function_name=self.name)
+
+        reset_query_count()
+        started = time.perf_counter()
+        result = self.index.handler(event, context)
+        elapsed = time.perf_counter() - started
+
+        raw = result.get('body') or ''
+        try:
+            parsed = json.loads(raw) if raw else None
+        except ValueError:
+            parsed = raw
+        return Response(result['statusCode'], parsed, elapsed, query_count())
+
+def load_functions() -> Dict[str, Function]:
+    install_query_counter()
+    names = sorted(p.parent.name for p in BACKEND_DIR.glob('*/index.py'))
+    return {name: Function(name) for name in names}
+
+def matches(expected: Any, actual: Any) -> Tuple[bool, str]:
+    # Семантика bodyMatcher "partial" из tests.json: "string" — любая строка, [] — любой список
+    if expected == 'string':
+        return isinstance(actual, str), f"ожидалась строка, получено {actual!r}"
+    if isinstance(expected, dict):
+        if not isinstance(actual, dict):
+            return False, f"ожидался объект, получено {actual!r}"
+        for key, value in expected.items():
+            if key not in actual:
+                return False, f"нет поля {key!r}"
+            ok, reason = matches(value, actual[key])
+            if not ok:
+                return False, f"{key}: {reason}"
+        return True, ''
+    if isinstance(expected, list):
+        if not isinstance(actual, list):
+            return False, f"ожидался список, получено {actual!r}"
+        for i, value in enumerate(expected):
+            if i >= len(actual):
+                return False, f"в списке нет элемента {i}"
+            ok, reason = matches(value, actual[i])
+            if not ok:
+                return False, f"[{i}]: {reason}"
+        return True, ''
+    return expected == actual, f"ожидалось {expected!r}, получено {actual!r}"
@@ -0,0 +1,306 @@
+"""
+Профили нагрузки: каждый засевает данные напрямую в базу и гоняет обработчики, возвращая серии замеров
+"""
+
+import hashlib
+import importlib.util
+import random
+import secrets
+import time
+import psycopg2
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import execute_values
+from typing import Callable, Dict, List, Tuple
+
+from harness.database import DisposableDatabase
+from harness.functions import ROOT, Function, Response
+
+EMOJIS = ['👍', '❤️', '😂', '😮', '😢', '🎮', '🚀', '⚡']
+WORDS = ['привет', 'игра', 'сервер', 'голосовой', 'канал', 'сегодня', 'вечером', 'рейд',
+         'hello', 'game', 'server', 'voice', 'tonight', 'match', 'stream', 'patch']
+
+class Context:
+    def __init__(self, db: DisposableDatabase, functions: Dict[str, Function], requests: int, concurrency: int,
+                 search_rows: int = 1000000):
+        self.db = db
+        self.functions = functions
+        self.requests = requests
+        self.concurrency = concurrency
+        self.search_rows = search_rows
+
+    def seed_users(self, count: int, prefix: str = 'user') -> List[Tuple[int, str]]:
+        # Пользователи и сессии одной пачкой; пароль у всех 'password' в старом формате хэша
+        conn = self.db.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """INSERT INTO users (username, discriminator, email, password_hash)
+                   SELECT %s || n, '0001', %s || n || '@harness.local', %s
+                   FROM generate_series(1, %s) n
+                   RETURNING id""",
+                (prefix, f"{prefix}-{secrets.token_hex(3)}-", hashlib.sha256(b'password').hexdigest(), count)
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            tokens = [secrets.token_urlsafe(32) for _ in ids]
+            execute_values(
+                cursor,
+                "INSERT INTO sessions (token_hash, user_id, expires_at) VALUES %s",
+                [(hashlib.sha256(token.encode()).hexdigest(), user_id) for user_id, token in zip(ids, tokens)],
+                template="(%s, %s, (now() AT TIME ZONE 'utc') + interval '1 day')"
+            )
+            return list(zip(ids, tokens))
+        finally:
+            conn.close()
+
+    def make_friends(self, user_id: int, friend_ids: List[int]) -> None:
+        conn = self.db.connect()
+        try:
+            execute_values(
+                conn.cursor(),
+                "INSERT INTO friendships (user_id, friend_id, status) VALUES %s ON CONFLICT DO NOTHING",
+                [(user_id, f, 'accepted') for f in friend_ids] + [(f, user_id, 'accepted') for f in friend_ids]
+            )
+        finally:
+            conn.close()
+
+    def run(self, count: int, call: Callable[[int], Response]) -> List[Response]:
+        if self.concurrency <= 1:
+            return [call(i) for i in range(count)]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(call, range(count)))
+
+def chatty_pair(ctx: Context) -> Dict[str, List[Response]]:
+    (a, token_a), (b, token_b) = ctx.seed_users(2, 'chatty')
+    ctx.make_friends(a, [b])
+    messages = ctx.functions['messages']
+    sends, polls = [], []
+    last_seen = {a: 0, b: 0}
+
+    for i in range(ctx.requests):
+        sender, token, peer, peer_token = (a, token_a, b, token_b) if i % 2 == 0 else (b, token_b, a, token_a)
+        sends.append(messages.invoke('POST', body={'action': 'send', 'recipient_id': peer, 'content': f'сообщение {i}'}, token=token))
+        poll = messages.invoke('GET', f'/?friend_id={sender}&after_id={last_seen[peer]}', token=peer_token)
+        if poll.status == 200 and poll.body['messages']:
+            last_seen[peer] = poll.body['messages'][-1]['id']
+        polls.append(poll)
+
+    return {'send': sends, 'poll after_id': polls}
+
+def large_friend_list(ctx: Context, friends: int = 1000) -> Dict[str, List[Response]]:
+    (owner, token), = ctx.seed_users(1, 'owner')
+    friend_ids = [user_id for user_id, _ in ctx.seed_users(friends, 'friend')]
+    ctx.make_friends(owner, friend_ids)
+    friends_fn = ctx.functions['friends']
+    return {f'friends GET ({friends})': ctx.run(ctx.requests, lambda i: friends_fn.invoke('GET', '/', token=token))}
+
+def reaction_storm(ctx: Context, reactors: int = 200) -> Dict[str, List[Response]]:
+    (a, token_a), (b, _) = ctx.seed_users(2, 'storm')
+    users = ctx.seed_users(reactors, 'reactor')
+    messages = ctx.functions['messages']
+    sent = messages.invoke('POST', body={'action': 'send', 'recipient_id': b, 'content': 'реагируйте'}, token=token_a)
+    message_id = sent.body['message']['id']
+    picks = [(token, random.choice(EMOJIS)) for _, token in users]
+
+    added = ctx.run(len(picks), lambda i: messages.invoke(
+        'POST', body={'action': 'add_reaction', 'message_id': message_id, 'emoji': picks[i][1]}, token=picks[i][0]))
+    history = ctx.run(ctx.requests, lambda i: messages.invoke('GET', f'/?friend_id={b}', token=token_a))
+    removed = ctx.run(len(picks) // 2, lambda i: messages.invoke(
+        'POST', body={'action': 'remove_reaction', 'message_id': message_id, 'emoji': picks[i][1]}, token=picks[i][0]))
+    return {'add_reaction': added, 'history GET': history, 'remove_reaction': removed}
+
+def registration_burst(ctx: Context) -> Dict[str, List[Response]]:
+    auth = ctx.functions['auth']
+    run_id = secrets.token_hex(3)
+    return {'register (одно имя)': ctx.run(ctx.requests, lambda i: auth.invoke('POST', body={
+        'action': 'register', 'username': 'Burst', 'email': f'burst-{run_id}-{i}@harness.local', 'password': 'password'
+    }))}
+
+def password_kdf(ctx: Context, costs: Tuple[int, ...] = (2 ** 12, 2 ** 14, 2 ** 15)) -> Dict[str, List[Response]]:
+    auth = ctx.functions['auth'].index
+    series = {}
+    for n in costs:
+        stored = auth.hash_password('password', n=n)
+
+        def verify(i: int) -> Response:
+            started = time.perf_counter()
+            ok = auth.verify_password('password', stored)
+            return Response(200 if ok else 401, None, time.perf_counter() - started, 0)
+
+        series[f'verify scrypt n={n}'] = ctx.run(max(ctx.requests // 10, 10), verify)
+    return series
+
+def channel_posters(ctx: Context, posters: int = 50) -> Dict[str, List[Response]]:
+    channels = ctx.functions['channels']
+    (owner, owner_token), = ctx.seed_users(1, 'admin')
+    users = ctx.seed_users(posters, 'poster')
+    created = channels.invoke('POST', body={'action': 'create_server', 'name': 'Нагрузка'}, token=owner_token)
+    server_id = created.body['server']['id']
+    channel_id = created.body['server']['channels'][0]['id']
+    for _, token in users:
+        channels.invoke('POST', body={'action': 'join', 'server_id': server_id}, token=token)
+
+    posts = ctx.run(ctx.requests, lambda i: channels.invoke(
+        'POST', body={'action': 'post', 'channel_id': channel_id, 'content': f'пост {i}'}, token=users[i % posters][1]))
+    history = ctx.run(ctx.requests, lambda i: channels.invoke('GET', f'/?channel_id={channel_id}', token=owner_token))
+    return {f'post ({posters} авторов)': posts, 'channel history GET': history}
+
+def message_search(ctx: Context) -> Dict[str, List[Response]]:
+    rows = ctx.search_rows
+    (a, token_a), (b, _), (c, _) = ctx.seed_users(3, 'search')
+    conn = ctx.db.connect()
+    try:
+        conn.cursor().execute(
+            """INSERT INTO direct_messages (sender_id, recipient_id, content)
+               SELECT CASE WHEN n %% 3 = 0 THEN %s ELSE %s END, CASE WHEN n %% 3 = 0 THEN %s ELSE %s END,
+                      (SELECT string_agg(w, ' ') FROM (
+                          SELECT (%s::text[])[1 + floor(random() * %s)::int] AS w
+                          FROM generate_series(1, 8 + (n %% 5))
+                      ) words)
+               FROM generate_series(1, %s) n""",
+            (a, b, b, c, WORDS, len(WORDS), rows)
+        )
+        conn.cursor().execute("ANALYZE direct_messages")
+    finally:
+        conn.close()
+
+    messages = ctx.functions['messages']
+    return {f'search ({rows} сообщений)': ctx.run(ctx.requests, lambda i: messages.invoke(
+        'POST', body={'action': 'search', 'query': random.choice(WORDS)}, token=token_a))}
+
+def load_worker(name: str):
+    spec = importlib.util.spec_from_file_location(f"worker_{name}", ROOT / 'worker' / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def friend_suggestions(ctx: Context, users: int = 100000, window: int = 200, degree: int = 20) -> Dict[str, List[Response]]:
+    # Синтетический граф: друзья выбираются из «соседства» в window id — так появляются общие друзья
+    seeded = ctx.seed_users(users, 'graph')
+    first_id = seeded[0][0]
+    conn = ctx.db.connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """WITH pairs AS (
+                   SELECT u.id AS a, %s + (u.id - %s + 1 + floor(random() * %s)::int) %% %s AS b
+                   FROM users u, generate_series(1, %s)
+                   WHERE u.id >= %s
+               )
+               INSERT INTO friendships (user_id, friend_id, status)
+               SELECT a, b, 'accepted' FROM pairs WHERE a <> b
+               UNION
+               SELECT b, a, 'accepted' FROM pairs WHERE a <> b
+               ON CONFLICT (user_id, friend_id) DO NOTHING""",
+            (first_id, first_id, window, users, degree // 2, first_id)
+        )
+        cursor.execute("ANALYZE friendships")
+    finally:
+        conn.close()
+
+    worker = load_worker('suggestions')
+    conn = psycopg2.connect(ctx.db.dsn)
+    refreshes = []
+    try:
+        worker.mark_all(conn)
+        while True:
+            started = time.perf_counter()
+            refreshed = worker.refresh_batch(conn)
+            if not refreshed:
+                break
+            refreshes.append(Response(200, refreshed, time.perf_counter() - started, 2))
+    finally:
+        conn.close()
+
+    friends = ctx.functions['friends']
+    sample = [random.choice(seeded) for _ in range(ctx.requests)]
+    table = ctx.run(ctx.requests, lambda i: friends.invoke('GET', '/?view=suggestions', token=sample[i][1]))
+
+    def live(i: int) -> Response:
+        # Для сравнения: прежний подход — обход в два шага на каждый запрос
+        live_conn = ctx.db.connect()
+        try:
+            cursor = live_conn.cursor()
+            started = time.perf_counter()
+            cursor.execute(
+                """SELECT f2.friend_id, COUNT(*) AS mutual_count
+                   FROM friendships f1
+                   JOIN friendships f2 ON f2.user_id = f1.friend_id AND f2.status = 'accepted'
+                   WHERE f1.user_id = %s AND f1.status = 'accepted' AND f2.friend_id <> f1.user_id
+                     AND NOT EXISTS (
+                         SELECT 1 FROM friendships x
+                         WHERE (x.user_id, x.friend_id) IN ((f1.user_id, f2.friend_id), (f2.friend_id, f1.user_id))
+                     )
+                   GROUP BY f2.friend_id
+                   ORDER BY mutual_count DESC, f2.friend_id
+                   LIMIT 10""",
+                (sample[i][0],)
+            )
+            cursor.fetchall()
+            return Response(200, None, time.perf_counter() - started, 1)
+        finally:
+            live_conn.close()
+
+    return {
+        f'refresh batch ({users} польз.)': refreshes,
+        'suggestions GET (таблица)': table,
+        'two-hop SQL на запрос': ctx.run(ctx.requests, live)
+    }
+
+def archived_history(ctx: Context, rows: int = 20000) -> Dict[str, List[Response]]:
+    # Половина переписки старше срока хранения: воркер переносит её в архив, GET листает обе таблицы
+    (a, token_a), (b, _) = ctx.seed_users(2, 'archive')
+    conn = ctx.db.connect()
+    try:
+        conn.cursor().execute(
+            """INSERT INTO direct_messages (sender_id, recipient_id, content, created_at)
+               SELECT CASE WHEN n %% 2 = 0 THEN %s ELSE %s END, CASE WHEN n %% 2 = 0 THEN %s ELSE %s END,
+                      'сообщение ' || n, LOCALTIMESTAMP - make_interval(days => 400) + make_interval(secs => n * (400 * 86400 / %s))
+               FROM generate_series(1, %s) n""",
+            (a, b, b, a, rows, rows)
+        )
+    finally:
+        conn.close()
+
+    worker = load_worker('retention')
+    conn = ctx.db.connect()
+    archives = []
+    try:
+        while True:
+            started = time.perf_counter()
+            moved, more = worker.archive_batch(conn, retention_days=200)
+            archives.append(Response(200, moved, time.perf_counter() - started, 1))
+            if not more:
+                break
+    finally:
+        conn.close()
+
+    messages = ctx.functions['messages']
+    pages = []
+    before_id = None
+    seen = 0
+    while True:
+        path = f'/?friend_id={b}&limit=200' + (f'&before_id={before_id}' if before_id else '')
+        page = messages.invoke('GET', path, token=token_a)
+        pages.append(page)
+        if page.status != 200 or not page.body['messages']:
+            break
+        seen += len(page.body['messages'])
+        before_id = page.body['messages'][0]['id']
+        if not page.body['has_more']:
+            break
+    if seen != rows:
+        raise RuntimeError(f'листание через архив вернуло {seen} сообщений из {rows}')
+
+    return {'archive batch': archives, 'history GET (горячая + архив)': pages}
+
+PROFILES: Dict[str, Callable[[Context], Dict[str, List[Response]]]] = {
+    'chatty_pair': chatty_pair,
+    'large_friend_list': large_friend_list,
+    'reaction_storm': reaction_storm,
+    'registration_burst': registration_burst,
+    'password_kdf': password_kdf,
+    'channel_posters': channel_posters,
+    'message_search': message_search,
+    'friend_suggestions': friend_suggestions,
+    'archived_history': archived_history,
+}
@@ -0,0 +1,152 @@
+"""
+Запуск стенда: python -m harness.run [--replay] [--check имя ...] [--checks] [--profile имя ...] [--search-rows N] [--no-pool] [--json]
+
+База: HARNESS_DATABASE_URL (создаётся и удаляется отдельная база) или временный кластер через initdb.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import secrets
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+from harness.checks import CHECKS
+from harness.database import DisposableDatabase
+from harness.functions import Response, load_functions, matches
+from harness.profiles import PROFILES, Context
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(name: str, responses: List[Response], wall: float) -> Dict[str, Any]:
+    latencies = [r.elapsed * 1000 for r in responses]
+    return {
+        'series': name,
+        'requests': len(responses),
+        'errors': sum(1 for r in responses if r.status >= 400),
+        'rps': round(len(responses) / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'queries_per_request': round(statistics.mean(r.queries for r in responses), 2) if responses else 0.0
+    }
+
+def seed_replay(db: DisposableDatabase) -> str:
+    # tests.json рассчитаны на пользователей 1 и 2 (TestUser#0001) — вызываем от имени первого
+    token = secrets.token_urlsafe(32)
+    conn = db.connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """INSERT INTO users (id, username, discriminator, email, password_hash) VALUES
+                   (1, 'Harness', '0001', 'harness@harness.local', %s),
+                   (2, 'TestUser', '0001', 'testuser@harness.local', %s)""",
+            (hashlib.sha256(b'password').hexdigest(), hashlib.sha256(b'password').hexdigest())
+        )
+        cursor.execute("SELECT setval(pg_get_serial_sequence('users', 'id'), 2)")
+        cursor.execute(
+            """INSERT INTO sessions (token_hash, user_id, expires_at)
+               VALUES (%s, 1, (now() AT TIME ZONE 'utc') + interval '1 day')""",
+            (hashlib.sha256(token.encode()).hexdigest(),)
+        )
+    finally:
+        conn.close()
+    return token
+
+def replay(db: DisposableDatabase, functions) -> bool:
+    token = seed_replay(db)
+    ok = True
+    for name, function in functions.items():
+        for test in function.tests():
+            response = function.invoke(test.get('method', 'GET'), test.get('path', '/'), test.get('body'), token=token)
+            passed = response.status == test.get('expectedStatus', 200)
+            reason = f"статус {response.status}, ожидался {test.get('expectedStatus', 200)}"
+            if passed and 'expectedBody' in test:
+                passed, reason = matches(test['expectedBody'], response.body)
+            ok = ok and passed
+            line = f"{'OK  ' if passed else 'FAIL'} {name}: {test.get('name')} ({response.elapsed * 1000:.1f} мс, запросов: {response.queries})"
+            print(line if passed else f"{line}\n     {reason}")
+    return ok
+
+def run_checks(db: DisposableDatabase, functions, names: List[str]) -> bool:
+    ok = True
+    for name in names:
+        db.reset()
+        started = time.perf_counter()
+        try:
+            CHECKS[name](Context(db, functions, 0, 1))
+            passed, reason = True, ''
+        except AssertionError as e:
+            passed, reason = False, str(e)
+        ok = ok and passed
+        line = f"{'OK  ' if passed else 'FAIL'} check: {name} ({(time.perf_counter() - started) * 1000:.0f} мс)"
+        print(line if passed else f"{line}\n     {reason}")
+    return ok
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    columns = ['series', 'requests', 'errors', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request']
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print('  '.join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print('  '.join(str(row[c]).ljust(widths[c]) for c in columns))
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Локальный прогон функций и профилей нагрузки')
+    parser.add_argument('--replay', action='store_true', help='прогнать tests.json всех функций')
+    parser.add_argument('--check', action='append', choices=sorted(CHECKS), help='проверка на засеянной базе (можно несколько)')
+    parser.add_argument('--checks', action='store_true', help='все проверки')
+    parser.add_argument('--profile', action='append', choices=sorted(PROFILES), help='профиль нагрузки (можно несколько)')
+    parser.add_argument('--all', action='store_true', help='все профили нагрузки')
+    parser.add_argument('--requests', type=int, default=200, help='запросов на серию')
+    parser.add_argument('--search-rows', type=int, default=1000000, help='размер корпуса для message_search')
+    parser.add_argument('--concurrency', type=int, default=1, help='параллельных потоков')
+    parser.add_argument('--no-pool', action='store_true', help='новое соединение на каждый вызов вместо пула')
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    args = parser.parse_args()
+
+    profiles = sorted(PROFILES) if args.all else (args.profile or [])
+    checks = sorted(CHECKS) if args.checks else (args.check or [])
+    if not args.replay and not profiles and not checks:
+        args.replay = True
+
+    with DisposableDatabase(os.environ.get('HARNESS_DATABASE_URL')) as db:
+        # Переменные окружения читаются модулями функций при импорте
+        os.environ['DATABASE_URL'] = db.dsn
+        os.environ.setdefault('DB_POOL_MAX', str(max(args.concurrency, 1) + 1))
+        functions = load_functions()
+        if args.no_pool:
+            for function in functions.values():
+                function.disable_pool()
+
+        ok = replay(db, functions) if args.replay else True
+        ok = run_checks(db, functions, checks) and ok
+
+        rows = []
+        for name in profiles:
+            db.reset()
+            ctx = Context(db, functions, args.requests, args.concurrency, args.search_rows)
+            started = time.perf_counter()
+            series = PROFILES[name](ctx)
+            wall = time.perf_counter() - started
+            for label, responses in series.items():
+                # Общее время профиля включает засев, поэтому rps считаем по сумме задержек серии
+                busy = sum(r.elapsed for r in responses) / max(args.concurrency, 1)
+                rows.append({'profile': name, **summarize(label, responses, busy or wall)})
+
+    if rows:
+        if args.json:
+            print(json.dumps(rows, ensure_ascii=False, indent=2))
+        else:
+            print_table(rows)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
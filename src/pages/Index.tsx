@@ -31,6 +31,7 @@ interface Message {
   created_at: string;
   username?: string;
   avatar?: string;
+  read?: boolean;
   reactions?: { emoji: string; count: number; users: string[] }[];
 }
 
@@ -44,6 +45,14 @@ interface Friend {
   unread_count?: number;
 }
 
+interface FriendRequest {
+  id: number;
+  username: string;
+  discriminator: string;
+  avatar: string;
+  created_at: string;
+}
+
 interface User {
   id: number;
   username: string;
@@ -53,6 +62,32 @@ interface User {
 }
 
 const EMOJIS = ['👍', '❤️', '😂', '😮', '😢', '🎮', '🚀', '⚡'];
+const MESSAGES_PAGE_SIZE = 50;
+const MESSAGES_REFRESH_SIZE = 200;
+const HEARTBEAT_INTERVAL_MS = 30000;
+const GATEWAY_URL = import.meta.env.VITE_GATEWAY_URL as string | undefined;
+
+// Одна и та же страница может прийти дважды (опрос, событие, ответ на отправку) — дописываем только новые id
+const appendNewMessages = (prev: Message[], page: Message[]) => {
+  const known = new Set(prev.map(m => m.id));
+  const fresh = page.filter(m => !known.has(m.id));
+  return fresh.length ? [...prev, ...fresh] : prev;
+};
+
+// Реакции и прочтение меняются у уже загруженных сообщений — правим их на месте, не трогая остальные страницы
+const applyMessageUpdates = (prev: Message[], updates: Pick<Message, 'id' | 'read' | 'reactions'>[]) => {
+  const byId = new Map(updates.map(u => [String(u.id), u]));
+  let changed = false;
+  const next = prev.map(m => {
+    const update = byId.get(m.id);
+    if (!update || (update.read === m.read && JSON.stringify(update.reactions) === JSON.stringify(m.reactions))) {
+      return m;
+    }
+    changed = true;
+    return { ...m, read: update.read, reactions: update.reactions };
+  });
+  return changed ? next : prev;
+};
 
 const Index = () => {
   const [user, setUser] = useState<User | null>(null);
@@ -65,7 +100,11 @@ const Index = () => {
   const [selectedFriend, setSelectedFriend] = useState<Friend | null>(null);
   const [messageInput, setMessageInput] = useState('');
   const [messages, setMessages] = useState<Message[]>([]);
+  const [hasOlderMessages, setHasOlderMessages] = useState(false);
+  const [realtimeConnected, setRealtimeConnected] = useState(false);
   const [friends, setFriends] = useState<Friend[]>([]);
+  const [incomingRequests, setIncomingRequests] = useState<FriendRequest[]>([]);
+  const [outgoingRequests, setOutgoingRequests] = useState<FriendRequest[]>([]);
   const [isTyping, setIsTyping] = useState(false);
   const [typingUsers, setTypingUsers] = useState<string[]>([]);
   const [inCall, setInCall] = useState(false);
@@ -84,6 +123,10 @@ const Index = () => {
   const [myStatus, setMyStatus] = useState<'online' | 'away' | 'offline'>('online');
   const scrollRef = useRef<HTMLDivElement>(null);
   const typingTimeoutRef = useRef<NodeJS.Timeout>();
+  const lastMessageIdRef = useRef<string | null>(null);
+  const scrollFromBottomRef = useRef<number | null>(null);
+  const selectedFriendRef = useRef<Friend | null>(null);
+  const messagesRef = useRef<Message[]>([]);
 
   const servers: Server[] = [
     { id: '1', name: 'Игровое Братство', icon: '🎮' },
@@ -112,20 +155,103 @@ const Index = () => {
   useEffect(() => {
     if (user) {
       loadFriends();
+      loadFriendRequests();
     }
   }, [user]);
 
   useEffect(() => {
+    if (!user || !token || myStatus === 'offline') return;
+
+    const sendHeartbeat = () => {
+      fetch('https://functions.poehali.dev/2ce585f6-ecfd-4273-a08d-8c63e688e6c2', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token },
+        body: JSON.stringify({ action: 'heartbeat', status: myStatus }),
+      }).catch((err) => console.error('Failed to send heartbeat:', err));
+    };
+    sendHeartbeat();
+    const interval = setInterval(sendHeartbeat, HEARTBEAT_INTERVAL_MS);
+    return () => clearInterval(interval);
+  }, [user, token, myStatus]);
+
+  useEffect(() => {
+    selectedFriendRef.current = selectedFriend;
     if (selectedFriend && user) {
       loadMessages(selectedFriend.id);
-      const interval = setInterval(() => loadMessages(selectedFriend.id), 3000);
-      return () => clearInterval(interval);
+      if (!realtimeConnected) {
+        const interval = setInterval(() => {
+          loadNewMessages(selectedFriend.id);
+          refreshLoadedMessages(selectedFriend.id);
+        }, 3000);
+        return () => clearInterval(interval);
+      }
     }
-  }, [selectedFriend, user]);
+  }, [selectedFriend, user, realtimeConnected]);
 
   useEffect(() => {
+    if (!user || !GATEWAY_URL) return;
+
+    const source = new EventSource(`${GATEWAY_URL}/events?token=${encodeURIComponent(token)}`);
+    source.onopen = () => setRealtimeConnected(true);
+    source.onerror = () => setRealtimeConnected(false);
+
+    source.addEventListener('message', (event) => {
+      const data = JSON.parse((event as MessageEvent).data);
+      const friend = selectedFriendRef.current;
+      if (friend && (data.sender_id === friend.id || data.recipient_id === friend.id)) {
+        loadNewMessages(friend.id);
+      } else {
+        loadFriends();
+      }
+    });
+    const refreshReactedMessage = (event: Event) => {
+      const data = JSON.parse((event as MessageEvent).data);
+      const friend = selectedFriendRef.current;
+      if (friend && messagesRef.current.some(m => m.id === String(data.message_id))) {
+        refreshLoadedMessages(friend.id, [String(data.message_id)]);
+      }
+    };
+    source.addEventListener('reaction_added', refreshReactedMessage);
+    source.addEventListener('reaction_removed', refreshReactedMessage);
+    source.addEventListener('read', (event) => {
+      const data = JSON.parse((event as MessageEvent).data);
+      const friend = selectedFriendRef.current;
+      if (friend && data.user_id === friend.id) {
+        setMessages(prev => applyMessageUpdates(prev, prev
+          .filter(m => m.sender_id !== friend.id && Number(m.id) <= data.last_read_message_id)
+          .map(m => ({ id: m.id, read: true, reactions: m.reactions }))));
+      }
+    });
+    source.addEventListener('friend_request', () => loadFriendRequests());
+    source.addEventListener('friend_accepted', () => {
+      loadFriends();
+      loadFriendRequests();
+    });
+    source.addEventListener('resync', () => {
+      const friend = selectedFriendRef.current;
+      if (friend) {
+        loadNewMessages(friend.id);
+        refreshLoadedMessages(friend.id);
+      }
+      loadFriends();
+      loadFriendRequests();
+    });
+
+    return () => {
+      source.close();
+      setRealtimeConnected(false);
+    };
+  }, [user]);
+
+  useEffect(() => {
+    messagesRef.current = messages;
     if (scrollRef.current) {
-      scrollRef.current.scrollTop = scrollRef.current.scrollHeight;
+      // После подгрузки старых сообщений держим позицию, иначе прокручиваем к последнему
+      const fromBottom = scrollFromBottomRef.current;
+      scrollFromBottomRef.current = null;
+      scrollRef.current.scrollTop = fromBottom === null
+        ? scrollRef.current.scrollHeight
+        : scrollRef.current.scrollHeight - fromBottom;
     }
   }, [messages]);
 
@@ -140,36 +266,149 @@ const Index = () => {
   const loadFriends = async () => {
     if (!user) return;
     try {
-      const response = await fetch(`https://functions.poehali.dev/1eef1767-d1ed-4c6a-84b3-2a2b75c0b19f?user_id=${user.id}`);
+      const response = await fetch('https://functions.poehali.dev/1eef1767-d1ed-4c6a-84b3-2a2b75c0b19f', {
+        headers: { 'X-Auth-Token': token },
+      });
       const data = await response.json();
       if (response.ok) {
         setFriends(data.friends || []);
+      } else if (response.status === 401) {
+        handleLogout();
       }
     } catch (err) {
       console.error('Failed to load friends:', err);
     }
   };
 
+  const loadFriendRequests = async () => {
+    if (!user) return;
+    try {
+      const response = await fetch('https://functions.poehali.dev/1eef1767-d1ed-4c6a-84b3-2a2b75c0b19f?view=requests', {
+        headers: { 'X-Auth-Token': token },
+      });
+      const data = await response.json();
+      if (response.ok) {
+        setIncomingRequests(data.incoming || []);
+        setOutgoingRequests(data.outgoing || []);
+      }
+    } catch (err) {
+      console.error('Failed to load friend requests:', err);
+    }
+  };
+
+  const respondToRequest = async (friendId: number, action: 'accept' | 'decline' | 'remove') => {
+    if (!user) return;
+    try {
+      const response = await fetch('https://functions.poehali.dev/1eef1767-d1ed-4c6a-84b3-2a2b75c0b19f', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token },
+        body: JSON.stringify({ action, friend_id: friendId }),
+      });
+      const data = await response.json();
+      if (!response.ok) {
+        alert(data.error || 'Ошибка обработки заявки');
+      }
+      loadFriendRequests();
+      if (action === 'accept') {
+        loadFriends();
+      }
+    } catch (err) {
+      alert('Ошибка подключения к серверу');
+    }
+  };
+
   const loadMessages = async (friendId: number) => {
     if (!user) return;
     try {
-      const response = await fetch(`https://functions.poehali.dev/5b880c12-ba0e-4d7b-a27b-b9df0eaebdf3?user_id=${user.id}&friend_id=${friendId}`);
+      const response = await fetch(`https://functions.poehali.dev/5b880c12-ba0e-4d7b-a27b-b9df0eaebdf3?friend_id=${friendId}&limit=${MESSAGES_PAGE_SIZE}`, {
+        headers: { 'X-Auth-Token': token },
+      });
       const data = await response.json();
       if (response.ok) {
-        setMessages(data.messages || []);
+        const page: Message[] = data.messages || [];
+        setMessages(page);
+        setHasOlderMessages(Boolean(data.has_more));
+        lastMessageIdRef.current = page.length ? page[page.length - 1].id : null;
       }
     } catch (err) {
       console.error('Failed to load messages:', err);
     }
   };
 
+  const loadNewMessages = async (friendId: number) => {
+    if (!user) return;
+    if (!lastMessageIdRef.current) {
+      loadMessages(friendId);
+      return;
+    }
+    try {
+      const response = await fetch(`https://functions.poehali.dev/5b880c12-ba0e-4d7b-a27b-b9df0eaebdf3?friend_id=${friendId}&after_id=${lastMessageIdRef.current}&limit=${MESSAGES_PAGE_SIZE}`, {
+        headers: { 'X-Auth-Token': token },
+      });
+      const data = await response.json();
+      if (response.ok) {
+        const page: Message[] = data.messages || [];
+        if (data.has_more) {
+          loadMessages(friendId);
+        } else if (page.length) {
+          lastMessageIdRef.current = page[page.length - 1].id;
+          setMessages(prev => appendNewMessages(prev, page));
+        }
+      }
+    } catch (err) {
+      console.error('Failed to load new messages:', err);
+    }
+  };
+
+  const refreshLoadedMessages = async (friendId: number, ids?: string[]) => {
+    if (!user) return;
+    const messageIds = ids || messagesRef.current.slice(-MESSAGES_REFRESH_SIZE).map(m => m.id);
+    if (!messageIds.length) return;
+    try {
+      const response = await fetch(`https://functions.poehali.dev/5b880c12-ba0e-4d7b-a27b-b9df0eaebdf3?friend_id=${friendId}&ids=${messageIds.join(',')}`, {
+        headers: { 'X-Auth-Token': token },
+      });
+      const data = await response.json();
+      if (response.ok && selectedFriendRef.current?.id === friendId) {
+        const next = applyMessageUpdates(messagesRef.current, data.messages || []);
+        if (next !== messagesRef.current) {
+          if (scrollRef.current) {
+            scrollFromBottomRef.current = scrollRef.current.scrollHeight - scrollRef.current.scrollTop;
+          }
+          setMessages(prev => applyMessageUpdates(prev, data.messages || []));
+        }
+      }
+    } catch (err) {
+      console.error('Failed to refresh messages:', err);
+    }
+  };
+
+  const loadOlderMessages = async () => {
+    if (!user || !selectedFriend || !messages.length) return;
+    try {
+      const response = await fetch(`https://functions.poehali.dev/5b880c12-ba0e-4d7b-a27b-b9df0eaebdf3?friend_id=${selectedFriend.id}&before_id=${messages[0].id}&limit=${MESSAGES_PAGE_SIZE}`, {
+        headers: { 'X-Auth-Token': token },
+      });
+      const data = await response.json();
+      if (response.ok) {
+        if (scrollRef.current) {
+          scrollFromBottomRef.current = scrollRef.current.scrollHeight - scrollRef.current.scrollTop;
+        }
+        setMessages(prev => [...(data.messages || []), ...prev]);
+        setHasOlderMessages(Boolean(data.has_more));
+      }
+    } catch (err) {
+      console.error('Failed to load older messages:', err);
+    }
+  };
+
   const sendMessage = async () => {
     if (!messageInput.trim() || !user || !selectedFriend) return;
 
     try {
       const response = await fetch('https://functions.poehali.dev/5b880c12-ba0e-4d7b-a27b-b9df0eaebdf3', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token },
         body: JSON.stringify({
           action: 'send',
           sender_id: user.id,
@@ -178,9 +417,17 @@ const Index = () => {
         }),
       });
 
+      const data = await response.json();
       if (response.ok) {
         setMessageInput('');
-        loadMessages(selectedFriend.id);
+        // Своё сообщение берём из ответа; событие шлюза о нём же отсеется по id.
+        // lastMessageIdRef не двигаем — иначе опрос пропустит ответы собеседника, пришедшие раньше
+        const { sender, ...message } = data.message;
+        setMessages(prev => appendNewMessages(prev, [
+          { ...message, username: sender.username, avatar: sender.avatar, reactions: [] },
+        ]));
+      } else {
+        alert(data.error || 'Не удалось отправить сообщение');
       }
     } catch (err) {
       console.error('Failed to send message:', err);
@@ -193,7 +440,7 @@ const Index = () => {
     try {
       const response = await fetch('https://functions.poehali.dev/1eef1767-d1ed-4c6a-84b3-2a2b75c0b19f', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token },
         body: JSON.stringify({
           action: 'add',
           user_id: user.id,
@@ -203,9 +450,10 @@ const Index = () => {
 
       const data = await response.json();
       if (response.ok) {
-        alert('Друг добавлен!');
+        alert(data.status === 'pending' ? 'Заявка отправлена!' : 'Друг добавлен!');
         setFriendCode('');
         loadFriends();
+        loadFriendRequests();
       } else {
         alert(data.error || 'Ошибка добавления друга');
       }
@@ -226,7 +474,7 @@ const Index = () => {
     try {
       await fetch('https://functions.poehali.dev/5b880c12-ba0e-4d7b-a27b-b9df0eaebdf3', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token },
         body: JSON.stringify({
           action: hasReacted ? 'remove_reaction' : 'add_reaction',
           message_id: messageId,
@@ -236,7 +484,7 @@ const Index = () => {
       });
 
       if (selectedFriend) {
-        loadMessages(selectedFriend.id);
+        refreshLoadedMessages(selectedFriend.id, [messageId]);
       }
     } catch (err) {
       console.error('Failed to toggle reaction:', err);
@@ -289,6 +537,13 @@ const Index = () => {
   );
 
   const handleLogout = () => {
+    if (token) {
+      fetch('https://functions.poehali.dev/2ce585f6-ecfd-4273-a08d-8c63e688e6c2', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'X-Auth-Token': token },
+        body: JSON.stringify({ action: 'logout' }),
+      }).catch(() => {});
+    }
     localStorage.removeItem('user');
     localStorage.removeItem('token');
     setUser(null);
@@ -368,6 +623,11 @@ const Index = () => {
               >
                 <Icon name="Users" size={18} className="mr-2" />
                 Все друзья ({friends.length})
+                {incomingRequests.length > 0 && (
+                  <Badge variant="secondary" className="ml-auto text-xs bg-primary text-white">
+                    {incomingRequests.length}
+                  </Badge>
+                )}
               </Button>
               <Separator className="my-2" />
               <div className="px-2 mb-2">
@@ -580,6 +840,76 @@ const Index = () => {
             </div>
 
             <ScrollArea className="flex-1 px-4 py-4">
+              {(incomingRequests.length > 0 || outgoingRequests.length > 0) && (
+                <div className="space-y-2 mb-6">
+                  {incomingRequests.length > 0 && (
+                    <h3 className="text-xs font-semibold text-muted-foreground uppercase tracking-wider px-3">
+                      Входящие заявки ({incomingRequests.length})
+                    </h3>
+                  )}
+                  {incomingRequests.map((request) => (
+                    <div
+                      key={`in-${request.id}`}
+                      className="flex items-center justify-between p-3 rounded-lg hover:bg-muted/30 transition-colors"
+                    >
+                      <div className="flex items-center gap-3 flex-1 min-w-0">
+                        <Avatar className="w-10 h-10">
+                          <AvatarFallback className="bg-primary text-lg">{request.avatar}</AvatarFallback>
+                        </Avatar>
+                        <p className="font-semibold truncate">{request.username}#{request.discriminator}</p>
+                      </div>
+                      <div className="flex gap-2">
+                        <Button
+                          variant="ghost"
+                          size="icon"
+                          className="w-9 h-9 text-green-500"
+                          onClick={() => respondToRequest(request.id, 'accept')}
+                        >
+                          <Icon name="Check" size={18} />
+                        </Button>
+                        <Button
+                          variant="ghost"
+                          size="icon"
+                          className="w-9 h-9 text-destructive"
+                          onClick={() => respondToRequest(request.id, 'decline')}
+                        >
+                          <Icon name="X" size={18} />
+                        </Button>
+                      </div>
+                    </div>
+                  ))}
+                  {outgoingRequests.length > 0 && (
+                    <h3 className="text-xs font-semibold text-muted-foreground uppercase tracking-wider px-3">
+                      Исходящие заявки ({outgoingRequests.length})
+                    </h3>
+                  )}
+                  {outgoingRequests.map((request) => (
+                    <div
+                      key={`out-${request.id}`}
+                      className="flex items-center justify-between p-3 rounded-lg hover:bg-muted/30 transition-colors"
+                    >
+                      <div className="flex items-center gap-3 flex-1 min-w-0">
+                        <Avatar className="w-10 h-10">
+                          <AvatarFallback className="bg-primary text-lg">{request.avatar}</AvatarFallback>
+                        </Avatar>
+                        <div className="flex-1 min-w-0">
+                          <p className="font-semibold truncate">{request.username}#{request.discriminator}</p>
+                          <p className="text-xs text-muted-foreground">Ожидает ответа</p>
+                        </div>
+                      </div>
+                      <Button
+                        variant="ghost"
+                        size="icon"
+                        className="w-9 h-9"
+                        onClick={() => respondToRequest(request.id, 'remove')}
+                      >
+                        <Icon name="X" size={18} />
+                      </Button>
+                    </div>
+                  ))}
+                  <Separator />
+                </div>
+              )}
               {friends.length === 0 ? (
                 <div className="text-center py-12">
                   <Icon name="Users" size={48} className="mx-auto mb-4 text-muted-foreground" />
@@ -677,6 +1007,13 @@ const Index = () => {
                 </div>
               ) : (
                 <div className="space-y-4">
+                  {hasOlderMessages && (
+                    <div className="flex justify-center">
+                      <Button variant="ghost" size="sm" onClick={loadOlderMessages}>
+                        Загрузить предыдущие сообщения
+                      </Button>
+                    </div>
+                  )}
                   {messages.map((message) => (
                     <div key={message.id} className="flex gap-3 hover:bg-muted/30 p-2 rounded-lg transition-colors animate-fade-in group relative">
                       <Avatar className="w-10 h-10 mt-1">
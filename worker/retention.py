@@ -0,0 +1,200 @@
+"""
+Business: Обслуживание истории — архивирование старых личных сообщений, удаление висячих реакций
+          и брошенных голосовых сессий, очистка индексов
+Args: DATABASE_URL, DM_RETENTION_DAYS, RETENTION_BATCH_SIZE, RETENTION_PAUSE_SECONDS, RETENTION_LOCK_TIMEOUT_MS,
+      RETENTION_INTERVAL_SECONDS, VOICE_SESSION_GRACE_MINUTES из окружения;
+      --once — один проход, --reindex — после прохода перестроить горячие индексы без блокировок
+Returns: долгоживущий процесс; каждая пачка — отдельная короткая транзакция, прерванный проход продолжается с места
+"""
+
+import argparse
+import os
+import time
+import psycopg2
+import psycopg2.errors
+from typing import Callable, Dict, List, Tuple
+
+RETENTION_DAYS = int(os.environ.get('DM_RETENTION_DAYS', '180'))
+BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '1000'))
+PAUSE_SECONDS = float(os.environ.get('RETENTION_PAUSE_SECONDS', '0.5'))
+LOCK_TIMEOUT_MS = int(os.environ.get('RETENTION_LOCK_TIMEOUT_MS', '1000'))
+INTERVAL_SECONDS = float(os.environ.get('RETENTION_INTERVAL_SECONDS', '3600'))
+VOICE_GRACE_MINUTES = int(os.environ.get('VOICE_SESSION_GRACE_MINUTES', '10'))
+
+HOT_INDEXES = ('idx_direct_messages_conversation', 'idx_direct_messages_search')
+MAINTAINED_TABLES = ('direct_messages', 'message_reactions')
+
+def connect():
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], application_name='retention-worker')
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        # Не ждём блокировок живых обработчиков: пачка просто повторится позже
+        cursor.execute("SET lock_timeout = %s", (f"{LOCK_TIMEOUT_MS}ms",))
+        cursor.execute("SET statement_timeout = '30s'")
+    return conn
+
+def archive_batch(conn, batch_size: int = BATCH_SIZE, retention_days: int = RETENTION_DAYS) -> Tuple[int, bool]:
+    # Берём самые старые batch_size строк по первичному ключу — пачка ограничена даже когда архивировать нечего
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """WITH candidates AS (
+                   SELECT id, created_at FROM direct_messages
+                   ORDER BY id
+                   LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+               ), moved AS (
+                   DELETE FROM direct_messages dm
+                   USING candidates c
+                   WHERE dm.id = c.id AND c.created_at < LOCALTIMESTAMP - make_interval(days => %s)
+                   RETURNING dm.id, dm.sender_id, dm.recipient_id, dm.content, dm.created_at, dm.reaction_count
+               )
+               INSERT INTO direct_messages_archive (id, sender_id, recipient_id, content, created_at, reaction_count)
+               SELECT id, sender_id, recipient_id, content, created_at, reaction_count FROM moved""",
+            (batch_size, retention_days)
+        )
+        return cursor.rowcount, cursor.rowcount > 0
+
+def sweep_reactions_batch(conn, batch_size: int = BATCH_SIZE) -> Tuple[int, bool]:
+    # Обход message_reactions по id с сохранённой позицией; у message_id нет внешнего ключа
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """WITH progress AS (
+                   SELECT COALESCE((SELECT position FROM maintenance_progress WHERE job = 'reactions_sweep'), 0) AS position
+               ), batch AS (
+                   SELECT r.id, r.message_id, r.message_type
+                   FROM message_reactions r, progress
+                   WHERE r.id > progress.position
+                   ORDER BY r.id
+                   LIMIT %s
+               ), dangling AS (
+                   DELETE FROM message_reactions r
+                   USING batch b
+                   WHERE r.id = b.id AND (
+                       (b.message_type = 'direct'
+                        AND NOT EXISTS (SELECT 1 FROM direct_messages WHERE id = b.message_id)
+                        AND NOT EXISTS (SELECT 1 FROM direct_messages_archive WHERE id = b.message_id))
+                       OR (b.message_type = 'channel'
+                           AND NOT EXISTS (SELECT 1 FROM channel_messages WHERE id = b.message_id))
+                   )
+                   RETURNING r.id
+               ), saved AS (
+                   -- Дошли до конца — следующий проход начнётся сначала
+                   INSERT INTO maintenance_progress (job, position, updated_at)
+                   SELECT 'reactions_sweep', CASE WHEN COUNT(*) < %s THEN 0 ELSE MAX(id) END, LOCALTIMESTAMP FROM batch
+                   ON CONFLICT (job) DO UPDATE SET position = EXCLUDED.position, updated_at = EXCLUDED.updated_at
+               )
+               SELECT (SELECT COUNT(*) FROM batch), (SELECT COUNT(*) FROM dangling)""",
+            (batch_size, batch_size)
+        )
+        scanned, deleted = cursor.fetchone()
+        return deleted, scanned == batch_size
+
+def prune_voice_sessions_batch(conn, batch_size: int = BATCH_SIZE,
+                               grace_minutes: int = VOICE_GRACE_MINUTES) -> Tuple[int, bool]:
+    # Сессия брошена, если пользователь давно зашёл в канал и с тех пор перестал слать heartbeat
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """DELETE FROM voice_sessions
+               WHERE id IN (
+                   SELECT v.id FROM voice_sessions v
+                   WHERE v.joined_at < LOCALTIMESTAMP - make_interval(mins => %s)
+                     AND NOT EXISTS (SELECT 1 FROM presence p WHERE p.user_id = v.user_id AND p.expires_at > now())
+                   LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+               )""",
+            (grace_minutes, batch_size)
+        )
+        return cursor.rowcount, cursor.rowcount == batch_size
+
+def run_job(name: str, batch: Callable[[], Tuple[int, bool]]) -> int:
+    total = 0
+    while True:
+        try:
+            done, more = batch()
+        except (psycopg2.errors.LockNotAvailable, psycopg2.errors.QueryCanceled):
+            # Упёрлись в блокировку или таймаут — уступаем живым обработчикам и пробуем позже
+            print(f"{name}: пачка отложена", flush=True)
+            time.sleep(PAUSE_SECONDS * 10)
+            continue
+        total += done
+        if not more:
+            return total
+        time.sleep(PAUSE_SECONDS)
+
+def drop_invalid_rebuilds(cursor) -> List[str]:
+    # Прерванный REINDEX CONCURRENTLY оставляет невалидные <индекс>_ccnew/_ccold, которые обновляет каждая вставка
+    cursor.execute(
+        """SELECT c.relname FROM pg_index i
+           JOIN pg_class c ON c.oid = i.indexrelid
+           JOIN pg_class t ON t.oid = i.indrelid
+           WHERE NOT i.indisvalid AND t.relname = ANY(%s)
+             AND (c.relname LIKE '%%\\_ccnew%%' OR c.relname LIKE '%%\\_ccold%%')""",
+        (list(MAINTAINED_TABLES),)
+    )
+    names = [row[0] for row in cursor.fetchall()]
+    for name in names:
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        print(f"удалён недостроенный индекс {name}", flush=True)
+    return names
+
+def maintain(conn, stats: Dict[str, int], reindex: bool) -> None:
+    # Освобождённые страницы индексов снова используются вставками, индексы перестают расти
+    steps = []
+    if stats['archived']:
+        steps += ["VACUUM (ANALYZE) direct_messages", "ANALYZE direct_messages_archive"]
+    if stats['reactions_deleted']:
+        steps.append("VACUUM (ANALYZE) message_reactions")
+    if reindex:
+        # Вернуть место на диск можно только перестройкой; CONCURRENTLY не блокирует запись
+        steps += [f"REINDEX INDEX CONCURRENTLY {index}" for index in HOT_INDEXES]
+
+    with conn.cursor() as cursor:
+        # VACUUM и REINDEX CONCURRENTLY ждут завершения старых транзакций (курсор выгрузки, воркер рекомендаций) —
+        # для них без ограничений по времени и ожиданию блокировок; пачкам вернём их после
+        cursor.execute("SET statement_timeout = 0")
+        cursor.execute("SET lock_timeout = 0")
+        try:
+            if reindex:
+                drop_invalid_rebuilds(cursor)
+            for step in steps:
+                try:
+                    cursor.execute(step)
+                except psycopg2.Error as e:
+                    # Ошибка обслуживания не останавливает воркер
+                    print(f"{step}: {(e.pgerror or str(e)).strip()}", flush=True)
+                    if step.startswith('REINDEX'):
+                        drop_invalid_rebuilds(cursor)
+        finally:
+            cursor.execute("SET lock_timeout = %s", (f"{LOCK_TIMEOUT_MS}ms",))
+            cursor.execute("SET statement_timeout = '30s'")
+
+def run_once(conn, reindex: bool = False) -> Dict[str, int]:
+    stats = {
+        'archived': run_job('archive', lambda: archive_batch(conn)),
+        'reactions_deleted': run_job('reactions', lambda: sweep_reactions_batch(conn)),
+        'voice_sessions_deleted': run_job('voice', lambda: prune_voice_sessions_batch(conn)),
+    }
+    maintain(conn, stats, reindex)
+    return stats
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Архивирование и очистка истории сообщений')
+    parser.add_argument('--once', action='store_true', help='один проход и выход')
+    parser.add_argument('--reindex', action='store_true', help='перестроить горячие индексы после прохода')
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        while True:
+            started = time.monotonic()
+            stats = run_once(conn, args.reindex)
+            summary = ', '.join(f"{key}={value}" for key, value in stats.items())
+            print(f"проход за {time.monotonic() - started:.1f} с: {summary}", flush=True)
+            if args.once:
+                return
+            time.sleep(INTERVAL_SECONDS)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
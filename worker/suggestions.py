@@ -0,0 +1,75 @@
+"""
+Business: Фоновый пересчёт рекомендаций друзей («возможно, вы знакомы»)
+Args: DATABASE_URL, SUGGESTIONS_BATCH_SIZE, SUGGESTIONS_TOP_K, SUGGESTIONS_INTERVAL_SECONDS из окружения;
+      --full помечает к пересчёту всех пользователей с друзьями, --once выходит, когда очередь пуста
+Returns: долгоживущий процесс, разбирающий friend_suggestions_dirty пачками
+"""
+
+import argparse
+import os
+import time
+import psycopg2
+
+BATCH_SIZE = int(os.environ.get('SUGGESTIONS_BATCH_SIZE', '500'))
+TOP_K = int(os.environ.get('SUGGESTIONS_TOP_K', '50'))
+INTERVAL_SECONDS = float(os.environ.get('SUGGESTIONS_INTERVAL_SECONDS', '10'))
+
+def mark_all(conn) -> int:
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """INSERT INTO friend_suggestions_dirty (user_id)
+               SELECT DISTINCT user_id FROM friendships WHERE status = 'accepted'
+               ON CONFLICT (user_id) DO UPDATE SET marked_at = EXCLUDED.marked_at"""
+        )
+        count = cursor.rowcount
+    conn.commit()
+    return count
+
+def refresh_batch(conn, batch_size: int = BATCH_SIZE, top_k: int = TOP_K) -> int:
+    # SKIP LOCKED: несколько воркеров разбирают очередь, не мешая друг другу
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """SELECT user_id FROM friend_suggestions_dirty
+               ORDER BY marked_at
+               LIMIT %s
+               FOR UPDATE SKIP LOCKED""",
+            (batch_size,)
+        )
+        user_ids = [row[0] for row in cursor.fetchall()]
+        if user_ids:
+            cursor.execute("SELECT refresh_friend_suggestions(%s, %s)", (user_ids, top_k))
+    conn.commit()
+    return len(user_ids)
+
+def drain(conn, batch_size: int = BATCH_SIZE, top_k: int = TOP_K) -> int:
+    total = 0
+    while True:
+        refreshed = refresh_batch(conn, batch_size, top_k)
+        total += refreshed
+        if refreshed < batch_size:
+            return total
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Пересчёт рекомендаций друзей')
+    parser.add_argument('--full', action='store_true', help='пересчитать всех пользователей с друзьями')
+    parser.add_argument('--once', action='store_true', help='разобрать очередь и выйти')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        if args.full:
+            print(f"помечено к пересчёту: {mark_all(conn)}", flush=True)
+        while True:
+            started = time.monotonic()
+            refreshed = drain(conn)
+            if refreshed:
+                elapsed = time.monotonic() - started
+                print(f"пересчитано {refreshed} пользователей за {elapsed:.1f} с", flush=True)
+            if args.once:
+                return
+            time.sleep(INTERVAL_SECONDS)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()